@@ -1,33 +1,81 @@
 import os
+import shutil
+import mimetypes
 import threading
 import time
 import json
+import math
 from datetime import datetime
-from flask import Flask, request, render_template, send_from_directory, redirect, url_for, jsonify
-from flask_socketio import SocketIO, emit
-import cv2
-import ffmpeg
+from flask import Flask, request, render_template, send_from_directory, redirect, url_for, jsonify, Response
+from flask_socketio import SocketIO, emit, join_room
 import uuid
-import numpy as np
 import redis
+import ffmpeg
+import pipeline
+import render
+import segments
+import thumbnails
+from scheduler import JobScheduler, QueueFullError
+from progress import ProgressPublisher
+from result_cache import ResultCache, CACHE_PREFIX, save_and_hash, make_cache_key
+from uploads import UploadStore, UploadError, is_streamable_prefix
+from preview import PreviewStore, PreviewBusyError, PreviewSourceMissingError
+from metrics import StageMetrics, stage_span
+from storage import StorageManager
+from probe import probe_input, ProbeError
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Socket.IO message queue (e.g. redis://localhost:6379/0) shared by several web processes, so events emitted
+# in one process reach browsers connected to any other
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'])
 
 # Redis connection for job management
 try:
-    redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+    redis_client = redis.Redis(
+        host=os.environ.get('REDIS_HOST', 'localhost'),
+        port=int(os.environ.get('REDIS_PORT', 6379)),
+        db=int(os.environ.get('REDIS_DB', 0)),
+        decode_responses=True
+    )
     redis_client.ping()  # Test connection
     REDIS_AVAILABLE = True
 except:
     print("Redis not available, using in-memory job storage")
     REDIS_AVAILABLE = False
     job_storage = {}  # Fallback to in-memory storage
+    if app.config['SOCKETIO_MESSAGE_QUEUE']:
+        print("⚠️ Several web processes need Redis: without it each one only sees its own jobs")
 
-# Global dictionary to track active processing threads and their cancellation flags
+# Stage timings of jobs run by this process (and relayed from workers), served at /metrics
+stage_metrics = StageMetrics()
+
+# Jobs queued or running in this process and their cancellation flags; everything else about a job is in Redis
 active_jobs = {}  # job_id -> {'thread': thread_obj, 'should_cancel': threading.Event()}
 
+# Redis keys used by the out-of-process worker tier (python -m worker)
+JOB_QUEUE_KEYS = ['jobs:queue:high', 'jobs:queue:normal', 'jobs:queue:low']  # highest priority first
+JOB_EVENTS_CHANNEL = 'job_events'
+JOB_WORKERS_KEY = 'jobs:workers'  # set of worker ids that have taken jobs
+JOB_PROCESSING_PREFIX = 'jobs:processing:'  # + worker id: list of job ids the worker took off the queues
+WORKER_HEARTBEAT_PREFIX = 'jobs:heartbeat:'  # + worker id: expires when the worker stops refreshing it
+WORKER_STAGES_KEY = 'metrics:worker_stages'  # stage spans from workers, each counted by the first web process to take it
+WORKER_STAGES_MAX = 10000
+# Cancellations for jobs queued or running in another web process
+JOB_CANCEL_CHANNEL = 'job_cancel'
+
+def to_redis_mapping(job_data):
+    """Convert job fields to values Redis can store"""
+    mapping = {}
+    for key, value in job_data.items():
+        if value is None:
+            value = ''
+        elif isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        mapping[key] = value
+    return mapping
+
 def cleanup_temp_files(temp_files):
     """Clean up temporary files"""
     for file_path in temp_files:
@@ -37,97 +85,109 @@ def cleanup_temp_files(temp_files):
         except Exception as e:
             print(f"Error cleaning up {file_path}: {e}")
 
-def cleanup_old_videos(max_files=3):
-    """Clean up old videos, keeping only the most recent ones"""
-    try:
-        # Video file extensions to clean up
-        video_extensions = {'.mp4', '.avi', '.mov', '.mkv', '.webm', '.flv', '.wmv'}
-        
-        # Get list of currently active job filenames to avoid deleting them
-        active_filenames = set()
-        for job_id, job_info in active_jobs.items():
-            job_data = get_job_status(job_id)
-            if job_data and job_data.get('status') in ['queued', 'processing']:
-                # Extract base filename from job
-                filename = job_data.get('filename', '')
-                if filename:
-                    active_filenames.add(filename)
-                    # Also protect files with job_id in the name
-                    active_filenames.add(f"{job_id}_{filename}")
-        
-        # Clean up both folders
-        for folder in [UPLOAD_FOLDER, PROCESSED_FOLDER]:
-            if not os.path.exists(folder):
-                continue
-                
-            folder_name = os.path.basename(folder)
-            print(f"Cleaning up {folder_name} folder...")
-                
-            # Get all video files with their modification times
-            files_with_times = []
-            for filename in os.listdir(folder):
-                if filename.startswith('.'):  # Skip hidden files
-                    continue
-                
-                # Only process video files
-                file_ext = os.path.splitext(filename)[1].lower()
-                if file_ext not in video_extensions:
-                    continue
-                    
-                file_path = os.path.join(folder, filename)
-                if os.path.isfile(file_path):
-                    # Check if file is from an active job
-                    is_active = False
-                    for active_name in active_filenames:
-                        if active_name in filename or filename in active_name:
-                            is_active = True
-                            break
-                    
-                    if not is_active:
-                        mod_time = os.path.getmtime(file_path)
-                        files_with_times.append((file_path, mod_time, filename))
-            
-            # Sort by modification time (newest first)
-            files_with_times.sort(key=lambda x: x[1], reverse=True)
-            
-            # Keep only the max_files most recent, delete the rest
-            files_to_delete = files_with_times[max_files:]
-            
-            deleted_count = 0
-            for file_path, mod_time, filename in files_to_delete:
-                try:
-                    file_size = os.path.getsize(file_path)
-                    os.remove(file_path)
-                    print(f"🗑️ Deleted old video: {filename} ({file_size / (1024*1024):.1f} MB)")
-                    deleted_count += 1
-                except Exception as e:
-                    print(f"❌ Error deleting {filename}: {e}")
-            
-            if deleted_count > 0:
-                remaining_count = len(files_with_times) - deleted_count
-                print(f"✅ Cleaned up {deleted_count} old videos from {folder_name}, keeping {remaining_count} recent files")
-            else:
-                print(f"📁 No cleanup needed in {folder_name} folder")
-                
-    except Exception as e:
-        print(f"❌ Error during cleanup: {e}")
-
 UPLOAD_FOLDER = 'static/uploads'
 PROCESSED_FOLDER = 'static/processed'
+PREVIEW_FOLDER = 'static/previews'
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv'}
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100 MB max upload size
-app.config['MAX_STORED_VIDEOS'] = 3  # Maximum number of videos to keep in each folder
+app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100 MB max upload size (per request, so per chunk for chunked uploads)
+# Total size limit for chunked uploads through /api/uploads
+app.config['MAX_UPLOAD_LENGTH'] = int(os.environ.get('MAX_UPLOAD_LENGTH', 2 * 1024 * 1024 * 1024))
+# Bytes a streaming upload needs before its container can be checked and processing started
+app.config['STREAM_START_BYTES'] = 1024 * 1024
+# Uploads and uncached outputs: byte budget, and time since last access after which they are deleted
+app.config['STORAGE_MAX_BYTES'] = int(os.environ.get('STORAGE_MAX_BYTES', 5 * 1024 * 1024 * 1024))
+app.config['STORAGE_TTL_SECONDS'] = int(os.environ.get('STORAGE_TTL_SECONDS', 24 * 3600))
+app.config['STORAGE_SWEEP_INTERVAL'] = int(os.environ.get('STORAGE_SWEEP_INTERVAL', 60))
+# Chunked uploads with no new chunk for this long (seconds) are abandoned and deleted by the sweeper
+app.config['UPLOAD_SESSION_TTL'] = int(os.environ.get('UPLOAD_SESSION_TTL', 3600))
+# Byte budget for cached results (least recently used are evicted first)
+app.config['RESULT_CACHE_MAX_BYTES'] = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+# Run blur/sharpen/edge_detect frame by frame in OpenCV instead of the equivalent FFmpeg filters
+app.config['OPENCV_FRAME_FILTERS'] = os.environ.get('OPENCV_FRAME_FILTERS', '0') == '1'
+# Threads filtering frames in parallel in the OpenCV branch
+app.config['FRAME_WORKERS'] = int(os.environ.get('FRAME_WORKERS', os.cpu_count() or 1))
+# Upper bound for the per-job 'segments' option (parallel segment processes)
+app.config['MAX_SEGMENTS'] = int(os.environ.get('MAX_SEGMENTS', os.cpu_count() or 1))
+# Jobs processed at the same time (each FFmpeg encode already uses several cores)
+app.config['MAX_CONCURRENT_JOBS'] = int(os.environ.get('MAX_CONCURRENT_JOBS', max(1, (os.cpu_count() or 2) // 2)))
+# Uploads are rejected with 429 once this many jobs are waiting
+app.config['MAX_QUEUED_JOBS'] = int(os.environ.get('MAX_QUEUED_JOBS', 20))
+# Seconds a job may wait before it runs ahead of cheaper jobs of its priority (cheapest-first can't starve it)
+app.config['MAX_QUEUE_WAIT'] = int(os.environ.get('MAX_QUEUE_WAIT', 600))
+# 'local' processes jobs in this process; 'redis' hands them to `python -m worker` processes
+app.config['JOB_BACKEND'] = os.environ.get('JOB_BACKEND', 'local') if REDIS_AVAILABLE else 'local'
+# Set by worker processes: job events go to Redis and web processes relay them to browsers
+app.config['PUBLISH_EVENTS_TO_REDIS'] = os.environ.get('PUBLISH_EVENTS_TO_REDIS', '0') == '1'
+# Progress updates are published at most this often per job (seconds)...
+app.config['PROGRESS_MIN_INTERVAL'] = float(os.environ.get('PROGRESS_MIN_INTERVAL', 0.5))
+# ...unless progress moved at least this many percent
+app.config['PROGRESS_MIN_DELTA'] = int(os.environ.get('PROGRESS_MIN_DELTA', 5))
+# Also package results as HLS (fMP4 segments) unless the job says otherwise
+app.config['HLS_OUTPUT'] = os.environ.get('HLS_OUTPUT', '0') == '1'
+app.config['HLS_SEGMENT_SECONDS'] = int(os.environ.get('HLS_SEGMENT_SECONDS', 4))
+# Poster and scrub thumbnails (one per THUMBNAIL_INTERVAL seconds) sampled while single-pass jobs render
+app.config['THUMBNAILS'] = os.environ.get('THUMBNAILS', '1') == '1'
+app.config['THUMBNAIL_INTERVAL'] = float(os.environ.get('THUMBNAIL_INTERVAL', 2.0))
+# Browser cache lifetime for processed files; output names are unique per job or content-addressed
+app.config['PROCESSED_MAX_AGE'] = int(os.environ.get('PROCESSED_MAX_AGE', 24 * 3600))
+
+# Previews: the first PREVIEW_SECONDS of a source at PREVIEW_HEIGHT lines, rendered synchronously
+app.config['PREVIEW_SECONDS'] = float(os.environ.get('PREVIEW_SECONDS', 5))
+app.config['PREVIEW_HEIGHT'] = int(os.environ.get('PREVIEW_HEIGHT', 360))
+app.config['PREVIEW_MAX_SOURCES'] = int(os.environ.get('PREVIEW_MAX_SOURCES', 8))
+app.config['MAX_CONCURRENT_PREVIEWS'] = int(os.environ.get('MAX_CONCURRENT_PREVIEWS', 2))
+# Rotation-only jobs into MP4/MOV set the display matrix with a stream copy instead of re-encoding
+app.config['METADATA_ROTATION'] = os.environ.get('METADATA_ROTATION', '1') == '1'
+# Upper bound on files x presets in one batch submission
+app.config['MAX_BATCH_OUTPUTS'] = int(os.environ.get('MAX_BATCH_OUTPUTS', 32))
+# Encoder profile of jobs that don't choose one: 'fast', 'balanced' or 'archive' (see pipeline.ENCODER_PROFILES)
+app.config['DEFAULT_ENCODER_PROFILE'] = os.environ.get('DEFAULT_ENCODER_PROFILE', pipeline.DEFAULT_ENCODER_PROFILE)
+# x264 threads per encode (0 = automatic; parallel segments then split the cores between them)
+app.config['ENCODER_THREADS'] = int(os.environ.get('ENCODER_THREADS', 0))
+# Previews favour turnaround over compression
+app.config['PREVIEW_ENCODER_PROFILE'] = os.environ.get('PREVIEW_ENCODER_PROFILE', 'fast')
+
+# Python's mimetypes table doesn't know the HLS types on every platform
+mimetypes.add_type('application/vnd.apple.mpegurl', '.m3u8')
+mimetypes.add_type('video/iso.segment', '.m4s')
 
 # Ensure the upload and processed directories exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 
-# Clean up old videos on startup
-print("Performing startup cleanup...")
-cleanup_old_videos(max_files=app.config['MAX_STORED_VIDEOS'])
+# Chunked upload sessions
+upload_store = UploadStore(session_ttl=app.config['UPLOAD_SESSION_TTL'])
+
+# Processed results keyed on input bytes + options
+result_cache = ResultCache(PROCESSED_FOLDER, app.config['RESULT_CACHE_MAX_BYTES'])
+
+# Low-resolution proxies for previewing options before submitting a job
+preview_store = PreviewStore(
+    PREVIEW_FOLDER,
+    max_sources=app.config['PREVIEW_MAX_SOURCES'],
+    seconds=app.config['PREVIEW_SECONDS'],
+    height=app.config['PREVIEW_HEIGHT'],
+    max_concurrent=app.config['MAX_CONCURRENT_PREVIEWS']
+)
+
+# Uploads and uncached outputs, evicted by a background sweeper (cached results evict themselves)
+storage = StorageManager(
+    [UPLOAD_FOLDER, PROCESSED_FOLDER],
+    max_bytes=app.config['STORAGE_MAX_BYTES'],
+    ttl_seconds=app.config['STORAGE_TTL_SECONDS'],
+    sweep_interval=app.config['STORAGE_SWEEP_INTERVAL'],
+    skip_prefixes=[CACHE_PREFIX],
+    # Processes sharing the folders share one index: sizes, last accesses and job references
+    shared=redis_client if REDIS_AVAILABLE else None,
+    # Sessions live in the process that created them, so each one expires its own
+    before_sweep=upload_store.expire
+)
+if not app.config['PUBLISH_EVENTS_TO_REDIS']:
+    # Worker processes don't see the web process's references, so only web processes sweep
+    storage.start()
 
 def allowed_file(filename):
     return '.' in filename and \
@@ -145,39 +205,60 @@ def create_job(job_id, filename, options):
         'message': 'Job queued for processing',
         'created_at': datetime.now().isoformat(),
         'output_filename': None,
-        'error': None
+        'error': None,
+        'stages': []
     }
     
     if REDIS_AVAILABLE:
-        redis_client.hset(f"job:{job_id}", mapping=job_data)
+        redis_client.hset(f"job:{job_id}", mapping=to_redis_mapping(job_data))
     else:
         job_storage[job_id] = job_data
     
     return job_data
 
-def update_job_progress(job_id, progress, message, status=None):
-    """Update job progress and emit to connected clients"""
+def emit_job_event(event, data):
+    """Send a job event to browsers, via Redis when running inside a worker process"""
+    if app.config['PUBLISH_EVENTS_TO_REDIS']:
+        redis_client.publish(JOB_EVENTS_CHANNEL, json.dumps({'event': event, 'data': data}))
+    else:
+        # Only clients that joined the job's room receive its events
+        socketio.emit(event, data, to=data['job_id'])
+
+def relay_redis_events():
+    """Forward job events published by worker processes to connected clients, and cancellations to local jobs"""
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(JOB_EVENTS_CHANNEL, JOB_CANCEL_CHANNEL)
+    for message in pubsub.listen():
+        try:
+            if message['channel'] == JOB_CANCEL_CHANNEL:
+                cancel_local_job(message['data'])
+                continue
+            payload = json.loads(message['data'])
+            if payload['event'] == 'job_completed':
+                release_job_files(payload['data']['job_id'], payload['data'].get('output_filename'))
+            # Every web process relays to its own clients, so the event must not also go through the message queue
+            socketio.emit(payload['event'], payload['data'], to=payload['data']['job_id'], ignore_queue=True)
+        except Exception as e:
+            print(f"❌ Error relaying Redis event: {e}")
+
+def write_job_fields(job_id, fields):
+    """Store changed job fields with a single write"""
     if REDIS_AVAILABLE:
-        job_data = redis_client.hgetall(f"job:{job_id}")
-        job_data['progress'] = progress
-        job_data['message'] = message
-        if status:
-            job_data['status'] = status
-        redis_client.hset(f"job:{job_id}", mapping=job_data)
+        redis_client.hset(f"job:{job_id}", mapping=to_redis_mapping(fields))
     else:
         if job_id in job_storage:
-            job_storage[job_id]['progress'] = progress
-            job_storage[job_id]['message'] = message
-            if status:
-                job_storage[job_id]['status'] = status
-    
-    # Emit progress to connected clients
-    socketio.emit('progress_update', {
-        'job_id': job_id,
-        'progress': progress,
-        'message': message,
-        'status': status or 'processing'
-    })
+            job_storage[job_id].update(fields)
+
+progress_publisher = ProgressPublisher(
+    write_job_fields,
+    lambda job_id, payload: emit_job_event('progress_update', payload),
+    min_interval=app.config['PROGRESS_MIN_INTERVAL'],
+    min_delta=app.config['PROGRESS_MIN_DELTA']
+)
+
+def update_job_progress(job_id, progress, message, status=None):
+    """Update job progress and emit to the job's subscribers (throttled and coalesced)"""
+    progress_publisher.publish(job_id, progress, message, status)
 
 def get_job_status(job_id):
     """Get current job status"""
@@ -191,67 +272,143 @@ def complete_job(job_id, output_filename=None, error=None):
     """Mark job as completed or failed"""
     status = 'completed' if output_filename else 'failed'
     
-    if REDIS_AVAILABLE:
-        job_data = redis_client.hgetall(f"job:{job_id}")
-        job_data['status'] = status
-        job_data['progress'] = 100 if output_filename else 0
-        job_data['output_filename'] = output_filename
-        job_data['error'] = error
-        job_data['completed_at'] = datetime.now().isoformat()
-        redis_client.hset(f"job:{job_id}", mapping=job_data)
-    else:
-        if job_id in job_storage:
-            job_storage[job_id]['status'] = status
-            job_storage[job_id]['progress'] = 100 if output_filename else 0
-            job_storage[job_id]['output_filename'] = output_filename
-            job_storage[job_id]['error'] = error
-            job_storage[job_id]['completed_at'] = datetime.now().isoformat()
+    # Held-back progress must not land after the final state
+    progress_publisher.discard(job_id)
+    write_job_fields(job_id, {
+        'status': status,
+        'progress': 100 if output_filename else 0,
+        'output_filename': output_filename,
+        'error': error,
+        'completed_at': datetime.now().isoformat()
+    })
     
     # Clean up active job tracking
     if job_id in active_jobs:
         del active_jobs[job_id]
+    release_job_files(job_id, output_filename)
     
     # Emit completion status
-    socketio.emit('job_completed', {
+    emit_job_event('job_completed', {
         'job_id': job_id,
         'status': status,
         'output_filename': output_filename,
         'error': error
     })
 
+def discard_output(output_path):
+    """Delete an output that won't be served (failed, empty or cancelled) and its render's sidecar directories
+
+    Only completed outputs are handed to the storage manager, so nothing
+    else would ever remove these.
+    """
+    cleanup_temp_files([output_path])
+    for name in pipeline.sidecar_dir_names(os.path.basename(output_path)):
+        shutil.rmtree(os.path.join(os.path.dirname(output_path), name), ignore_errors=True)
+
+def release_job_files(job_id, output_filename=None):
+    """Hand a finished job's files to the storage manager's eviction"""
+    if output_filename and not output_filename.startswith(CACHE_PREFIX):
+        storage.add(os.path.join(PROCESSED_FOLDER, output_filename))
+    storage.release(job_id)
+
+def job_outputs(job):
+    """Per-output state of a batch job (stored as JSON in Redis)"""
+    outputs = job.get('outputs') or []
+    if isinstance(outputs, str):
+        outputs = json.loads(outputs)
+    return outputs
+
+def job_stages(job):
+    """Stage spans recorded for a job (stored as JSON in Redis)"""
+    stages = job.get('stages') or []
+    if isinstance(stages, str):
+        stages = json.loads(stages)
+    return stages
+
+def record_stage(job_id, span):
+    """Append a finished stage span to the job and count it in /metrics"""
+    job = get_job_status(job_id)
+    if job is None:
+        return
+    write_job_fields(job_id, {'stages': job_stages(job) + [span]})
+    if app.config['PUBLISH_EVENTS_TO_REDIS']:
+        # Worker process: the web processes serve /metrics, see take_worker_stages
+        redis_client.rpush(WORKER_STAGES_KEY, json.dumps(span))
+        redis_client.ltrim(WORKER_STAGES_KEY, -WORKER_STAGES_MAX, -1)
+    else:
+        stage_metrics.observe(span)
+
+def take_worker_stages():
+    """Count the stage spans workers queued since the last scrape of any web process"""
+    while True:
+        # LPOP hands each span to exactly one web process, so summing their /metrics counts it once
+        spans = redis_client.lpop(WORKER_STAGES_KEY, 500)
+        if not spans:
+            return
+        for span in spans:
+            stage_metrics.observe(json.loads(span))
+
+def job_stage(job_id, stage):
+    """Context manager measuring one stage of a job, see metrics.stage_span"""
+    return stage_span(stage, lambda span: record_stage(job_id, span))
+
+def file_size(path):
+    return os.path.getsize(path) if path and os.path.exists(path) else 0
+
+def cancel_local_job(job_id):
+    """Stop a job queued or running in this process; returns False if it isn't here"""
+    job_info = active_jobs.get(job_id)
+    if not job_info:
+        return False
+    # Signal the thread to stop, or drop the job if it has not started yet
+    job_info['should_cancel'].set()
+    if job_scheduler.cancel(job_id):
+        active_jobs.pop(job_id, None)
+        storage.release(job_id)
+    return True
+
+def cancel_remote_job(job_id):
+    """Cancel a job owned by the worker tier or another web process; returns False if it already finished"""
+    job = get_job_status(job_id)
+    if not job or job.get('status') not in ('queued', 'processing'):
+        return False
+    # Still waiting for a worker: take it off the queue so no worker picks it up
+    for key in JOB_QUEUE_KEYS:
+        if redis_client.lrem(key, 0, job_id):
+            return True
+    # Running, or queued in another web process: workers poll the flag, web processes subscribe to the channel
+    redis_client.set(f"job:{job_id}:cancel", 1, ex=3600)
+    redis_client.publish(JOB_CANCEL_CHANNEL, job_id)
+    return True
+
 def cancel_job(job_id):
-    """Cancel a running job"""
-    if job_id in active_jobs:
-        # Signal the thread to stop
-        active_jobs[job_id]['should_cancel'].set()
-        
-        # Update job status
-        if REDIS_AVAILABLE:
-            job_data = redis_client.hgetall(f"job:{job_id}")
-            job_data['status'] = 'cancelled'
-            job_data['progress'] = 0
-            job_data['message'] = 'Job cancelled by user'
-            job_data['error'] = 'Processing cancelled by user'
-            job_data['completed_at'] = datetime.now().isoformat()
-            redis_client.hset(f"job:{job_id}", mapping=job_data)
-        else:
-            if job_id in job_storage:
-                job_storage[job_id]['status'] = 'cancelled'
-                job_storage[job_id]['progress'] = 0
-                job_storage[job_id]['message'] = 'Job cancelled by user'
-                job_storage[job_id]['error'] = 'Processing cancelled by user'
-                job_storage[job_id]['completed_at'] = datetime.now().isoformat()
-        
-        # Emit cancellation status
-        socketio.emit('job_completed', {
-            'job_id': job_id,
-            'status': 'cancelled',
-            'output_filename': None,
-            'error': 'Processing cancelled by user'
-        })
-        
-        return True
-    return False
+    """Cancel a queued or running job, whichever process owns it"""
+    if not cancel_local_job(job_id) and not (REDIS_AVAILABLE and cancel_remote_job(job_id)):
+        return False
+    mark_job_cancelled(job_id)
+    return True
+
+def mark_job_cancelled(job_id):
+    """Release a cancelled job's files and report it as cancelled"""
+    storage.release(job_id)
+    
+    # Update job status
+    progress_publisher.discard(job_id)
+    write_job_fields(job_id, {
+        'status': 'cancelled',
+        'progress': 0,
+        'message': 'Job cancelled by user',
+        'error': 'Processing cancelled by user',
+        'completed_at': datetime.now().isoformat()
+    })
+    
+    # Emit cancellation status
+    emit_job_event('job_completed', {
+        'job_id': job_id,
+        'status': 'cancelled',
+        'output_filename': None,
+        'error': 'Processing cancelled by user'
+    })
 
 def process_video_background(job_id, input_path, output_path, options, original_filename):
     """Background video processing function with progress updates"""
@@ -261,311 +418,413 @@ def process_video_background(job_id, input_path, output_path, options, original_
         complete_job(job_id, error="Job cancellation system not initialized")
         return
     
-    # List to track temporary files for cleanup
-    temp_files = []
-    
     try:
         # Check for cancellation before starting
         if should_cancel.is_set():
-            cleanup_temp_files(temp_files)
             return
             
-        update_job_progress(job_id, 5, "Starting video processing...")
-        
-        transformation = options.get('transformation', 'none')
-        selected_filter = options.get('filter', 'none')
-        speed = float(options.get('speed', '1.0'))
-        brightness_str = options.get('brightness', '1.0')
-        contrast_str = options.get('contrast', '1.0')
-        
-        unique_id = job_id
+        update_job_progress(job_id, 5, "Starting video processing...", 'processing')
         
         # Check for cancellation
         if should_cancel.is_set():
-            cleanup_temp_files(temp_files)
             return
-            
-        update_job_progress(job_id, 10, "Initializing FFmpeg stream...")
         
-        stream = ffmpeg.input(input_path)
-        ffmpeg_filters_applied_this_pass = False
-
-        # Apply transformations
-        if transformation == 'grayscale':
-            stream = stream.filter('format', pix_fmts='gray')
-            ffmpeg_filters_applied_this_pass = True
-        elif transformation == 'invert':
-            stream = stream.filter('negate')
-            ffmpeg_filters_applied_this_pass = True
-        elif transformation == 'hflip':
-            stream = stream.hflip()
-            ffmpeg_filters_applied_this_pass = True
-        elif transformation == 'vflip':
-            stream = stream.vflip()
-            ffmpeg_filters_applied_this_pass = True
-        elif transformation == 'rotate90':
-            stream = stream.filter('rotate', 'PI/2')
-            ffmpeg_filters_applied_this_pass = True
-        elif transformation == 'rotate180':
-            stream = stream.filter('rotate', 'PI')
-            ffmpeg_filters_applied_this_pass = True
-        elif transformation == 'rotate270':
-            stream = stream.filter('rotate', '3*PI/2')
-            ffmpeg_filters_applied_this_pass = True
+        def report_render_progress(fraction, message):
+            update_job_progress(job_id, 10 + int(fraction * 80), message)  # 10-90% for rendering
         
-        update_job_progress(job_id, 20, "Applying color adjustments...")
+        render_kwargs = {
+            'opencv_frame_filters': app.config['OPENCV_FRAME_FILTERS'],
+            'frame_workers': app.config['FRAME_WORKERS'],
+            'encoder_threads': app.config['ENCODER_THREADS']
+        }
+        if options.get('upload_length'):
+            # Streaming upload: read the input while it is still being written
+            render_kwargs['growing_input_length'] = int(options['upload_length'])
+        segment_count = int(options.get('segments', 1))
+        metadata_rotation = app.config['METADATA_ROTATION'] and pipeline.supports_display_matrix(output_path)
+        plan = pipeline.plan_processing(options, metadata_rotation)
+        if plan['stream_copy']:
+            # A copy is faster than splitting and joining segments
+            segment_count = 1
         
-        # Apply brightness/contrast
-        eq_params = {}
-        try:
-            b_val = float(brightness_str)
-            if b_val != 1.0:
-                eq_params['brightness'] = b_val - 1.0
-        except ValueError:
-            pass
-        try:
-            c_val = float(contrast_str)
-            if c_val != 1.0:
-                eq_params['contrast'] = c_val
-        except ValueError:
-            pass
-
-        if eq_params:
-            stream = stream.filter('eq', **eq_params)
-            ffmpeg_filters_applied_this_pass = True
-
-        # Speed adjustment for non-OpenCV filters
-        if selected_filter == 'none' and speed != 1.0:
-            stream = stream.setpts(f'{1/speed}*PTS')
-            ffmpeg_filters_applied_this_pass = True
+        if plan['stream_copy'] or plan['display_rotation'] is not None:
+            render_stage = 'stream_copy'
+        elif segment_count > 1:
+            render_stage = 'segments'
+        elif render_engine(options) == 'opencv':
+            render_stage = 'opencv_loop'
+        else:
+            render_stage = 'ffmpeg_pass'
         
-        update_job_progress(job_id, 30, "Processing video filters...")
+        try:
+            with job_stage(job_id, render_stage) as span:
+                if options.get('upload_length'):
+                    span['bytes_read'] = int(options['upload_length'])
+                else:
+                    span['bytes_read'] = file_size(input_path)
+                    span['frames'] = options['probe']['total_frames']
+                if segment_count > 1:
+                    finished = segments.render_segmented(input_path, output_path, options, should_cancel,
+                                                         report_render_progress, segment_count,
+                                                         source_info=options.get('probe'), **render_kwargs)
+                else:
+                    thumbnails_dir = None
+                    if app.config['THUMBNAILS']:
+                        # Moved along with the output if it goes into the result cache
+                        thumbnails_dir = os.path.join(os.path.dirname(output_path),
+                                                      pipeline.thumbnails_dir_name(os.path.basename(output_path)))
+                    finished = render.render_video(input_path, output_path, options, should_cancel,
+                                                   report_render_progress,
+                                                   metadata_rotation=app.config['METADATA_ROTATION'],
+                                                   source_info=options.get('probe'),
+                                                   thumbnails_dir=thumbnails_dir,
+                                                   thumbnail_interval=app.config['THUMBNAIL_INTERVAL'],
+                                                   **render_kwargs)
+                span['bytes_written'] = file_size(output_path)
+        except render.RenderError as e:
+            discard_output(output_path)
+            complete_job(job_id, error=str(e))
+            return
         
-        # Handle OpenCV filters with progress tracking
-        if selected_filter != 'none':
-            opencv_input_path = None
-            audio_source_path_for_final_ffmpeg = None
-            temp_ffmpeg_output = None
-
-            if ffmpeg_filters_applied_this_pass:
-                update_job_progress(job_id, 35, "Applying FFmpeg transformations...")
-                temp_ffmpeg_output_filename = "temp_ffmpeg_" + original_filename + "_" + unique_id + ".mp4"
-                temp_ffmpeg_output = os.path.join(app.config['PROCESSED_FOLDER'], temp_ffmpeg_output_filename)
-                temp_files.append(temp_ffmpeg_output)
-                
-                very_temp_video_only_filename = f"very_temp_v_{unique_id}.mkv"
-                very_temp_video_only_path = os.path.join(app.config['PROCESSED_FOLDER'], very_temp_video_only_filename)
-                temp_files.append(very_temp_video_only_path)
-                
-                try:
-                    stream.output(very_temp_video_only_path, vcodec='libx264', an=None)\
-                               .run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
-                    
-                    update_job_progress(job_id, 40, "Muxing audio and video...")
-                    
-                    try:
-                        video_input_for_mux = ffmpeg.input(very_temp_video_only_path)
-                        audio_input_for_mux = ffmpeg.input(input_path)
-                        ffmpeg.output(video_input_for_mux.video, audio_input_for_mux.audio,
-                                      temp_ffmpeg_output,
-                                      vcodec='copy', acodec='aac', strict='experimental', shortest=None
-                                     ).run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
-                        opencv_input_path = temp_ffmpeg_output
-                        audio_source_path_for_final_ffmpeg = temp_ffmpeg_output
-                    except ffmpeg.Error as e_mux:
-                        error_str_mux = e_mux.stderr.decode('utf8')
-                        if "Stream map 'a' matches no streams" in error_str_mux or "Cannot select audio stream" in error_str_mux:
-                            ffmpeg.input(very_temp_video_only_path).output(temp_ffmpeg_output, vcodec='copy', an=None).run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
-                            opencv_input_path = temp_ffmpeg_output
-                            audio_source_path_for_final_ffmpeg = None
-                        else:
-                            raise
-                    finally:
-                        if os.path.exists(very_temp_video_only_path):
-                            os.remove(very_temp_video_only_path)
-                except ffmpeg.Error as e:
-                    complete_job(job_id, error=f"FFmpeg processing error: {e.stderr.decode('utf8')}")
-                    return
-            else:
-                opencv_input_path = input_path
-                audio_source_path_for_final_ffmpeg = input_path
-            
-            update_job_progress(job_id, 45, "Starting OpenCV processing...")
-            
-            # OpenCV processing with frame-level progress
-            cap = cv2.VideoCapture(opencv_input_path)
-            if not cap.isOpened():
-                complete_job(job_id, error=f"Could not open video file: {opencv_input_path}")
-                return
-
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            
-            if fps == 0:
-                fps = 25.0
-
-            temp_opencv_filename = "temp_opencv_" + original_filename + "_" + unique_id + ".avi"
-            temp_opencv_output_path = os.path.join(app.config['PROCESSED_FOLDER'], temp_opencv_filename)
-            temp_files.append(temp_opencv_output_path)
-            
-            fourcc_cv = cv2.VideoWriter_fourcc(*'XVID')
-            out_cv = cv2.VideoWriter(temp_opencv_output_path, fourcc_cv, fps, (width, height))
-            
-            if not out_cv.isOpened():
-                cap.release()
-                complete_job(job_id, error="OpenCV VideoWriter failed to open")
-                return
-
-            frame_count = 0
-            processed_frames_written = 0
-            
-            while cap.isOpened():
-                # Check for cancellation before processing each frame
-                if should_cancel.is_set():
-                    cap.release()
-                    out_cv.release()
-                    cleanup_temp_files(temp_files)
-                    return
-                    
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                
-                frame_count += 1
-                if frame is None:
-                    continue
-                
-                # Apply OpenCV filter
-                processed_frame = frame
-                if selected_filter == 'blur':
-                    processed_frame = cv2.GaussianBlur(frame, (15, 15), 0)
-                elif selected_filter == 'sharpen':
-                    kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
-                    processed_frame = cv2.filter2D(frame, -1, kernel)
-                elif selected_filter == 'edge_detect':
-                    gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                    processed_frame_gray = cv2.Canny(gray_frame, 100, 200)
-                    processed_frame = cv2.cvtColor(processed_frame_gray, cv2.COLOR_GRAY2BGR)
-                
-                if processed_frame is not None:
-                    out_cv.write(processed_frame)
-                    processed_frames_written += 1
-                
-                # Update progress every 30 frames
-                if frame_count % 30 == 0 and total_frames > 0:
-                    progress = 45 + int((frame_count / total_frames) * 30)  # 45-75% for OpenCV processing
-                    update_job_progress(job_id, progress, f"Processing frame {frame_count}/{total_frames}")
-
-            cap.release()
-            out_cv.release()
-            
-            update_job_progress(job_id, 75, "Finalizing video encoding...")
-            
-            # Final FFmpeg re-encoding
-            if os.path.exists(temp_opencv_output_path) and os.path.getsize(temp_opencv_output_path) > 0:
-                try:
-                    input_video_stream = ffmpeg.input(temp_opencv_output_path, r=str(fps))
-                    output_streams = [input_video_stream.video]
-                    
-                    output_options = {
-                        'vcodec': 'libx264',
-                        'r': str(fps),
-                        'video_bitrate': '1500k'
-                    }
-                    
-                    if audio_source_path_for_final_ffmpeg:
-                        try:
-                            input_audio_stream = ffmpeg.input(audio_source_path_for_final_ffmpeg).audio
-                            output_streams.append(input_audio_stream)
-                            output_options['acodec'] = 'aac'
-                            output_options['strict'] = 'experimental'
-                        except:
-                            pass
-                    
-                    ffmpeg.output(*output_streams, output_path, **output_options).run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
-                    
-                    # Clean up temporary files
-                    if os.path.exists(temp_opencv_output_path):
-                        os.remove(temp_opencv_output_path)
-                    if temp_ffmpeg_output and os.path.exists(temp_ffmpeg_output):
-                        os.remove(temp_ffmpeg_output)
-                    
-                except ffmpeg.Error as e:
-                    complete_job(job_id, error=f"Final encoding error: {e.stderr.decode('utf8')}")
-                    return
-            else:
-                complete_job(job_id, error="OpenCV processing failed to produce valid output")
-                return
-
-            # Handle speed adjustment for OpenCV processed videos
-            if speed != 1.0:
-                update_job_progress(job_id, 85, f"Applying speed adjustment ({speed}x)...")
-                speed_adjusted_input_path = output_path
-                final_speed_adjusted_filename = "speed_adj_" + os.path.basename(output_path)
-                final_speed_adjusted_path = os.path.join(app.config['PROCESSED_FOLDER'], final_speed_adjusted_filename)
-                
-                try:
-                    speed_adj_stream = ffmpeg.input(speed_adjusted_input_path).setpts(f'{1/speed}*PTS')
-                    speed_adj_stream.output(final_speed_adjusted_path, vcodec='libx264', acodec='aac', strict='experimental').run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
-                    
-                    if os.path.exists(speed_adjusted_input_path) and speed_adjusted_input_path != final_speed_adjusted_path:
-                        os.remove(speed_adjusted_input_path)
-                    
-                    output_path = final_speed_adjusted_path
-                    output_filename = final_speed_adjusted_filename
-                except ffmpeg.Error as e:
-                    complete_job(job_id, error=f"Speed adjustment error: {e.stderr.decode('utf8')}")
-                    return
-
-        else:
-            # Direct FFmpeg processing
-            if ffmpeg_filters_applied_this_pass:
-                update_job_progress(job_id, 50, "Processing with FFmpeg...")
-                try:
-                    stream.output(output_path, vcodec='libx264', acodec='aac', strict='experimental').run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
-                except ffmpeg.Error as e:
-                    complete_job(job_id, error=f"FFmpeg processing error: {e.stderr.decode('utf8')}")
-                    return
-            else:
-                update_job_progress(job_id, 80, "Copying video file...")
-                try:
-                    ffmpeg.input(input_path).output(output_path, vcodec='copy', acodec='copy').run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
-                except ffmpeg.Error as e:
-                    complete_job(job_id, error=f"Video copy error: {e.stderr.decode('utf8')}")
-                    return
+        if not finished:
+            discard_output(output_path)
+            return
 
         update_job_progress(job_id, 95, "Finalizing...")
         
         # Verify output file
         if not os.path.exists(output_path):
+            discard_output(output_path)
             complete_job(job_id, error="Processed file not found")
             return
         
         if os.path.getsize(output_path) == 0:
+            discard_output(output_path)
             complete_job(job_id, error="Processed file is empty")
             return
         
         # Final cancellation check
         if should_cancel.is_set():
-            cleanup_temp_files(temp_files)
+            discard_output(output_path)
             return
             
+        # Keep the result for identical resubmissions
+        if options.get('cache_key'):
+            output_path = result_cache.store(options['cache_key'], output_path)
+        
+        if pipeline.parse_float(options.get('hls', '0'), 0):
+            update_job_progress(job_id, 97, "Packaging HLS stream...")
+            with job_stage(job_id, 'hls_package') as span:
+                span['bytes_read'] = file_size(output_path)
+                package_hls(output_path)
+        
         output_filename = os.path.basename(output_path)
         update_job_progress(job_id, 100, "Processing completed successfully!", "completed")
         complete_job(job_id, output_filename=output_filename)
         
-        # Clean up old videos after successful completion
-        print(f"Job {job_id} completed successfully, cleaning up old videos...")
-        cleanup_old_videos(max_files=app.config['MAX_STORED_VIDEOS'])
+    except Exception as e:
+        if not os.path.basename(output_path).startswith(CACHE_PREFIX):
+            discard_output(output_path)  # a result already moved into the cache stays there
+        complete_job(job_id, error=f"Unexpected error: {str(e)}")
+
+def package_hls(output_path):
+    """Repackage a processed MP4 as HLS next to it; returns the playlist path or None"""
+    hls_dir = os.path.join(app.config['PROCESSED_FOLDER'], pipeline.hls_dir_name(os.path.basename(output_path)))
+    playlist_path = os.path.join(hls_dir, pipeline.HLS_PLAYLIST)
+    if os.path.exists(playlist_path):
+        return playlist_path  # Cached result that was packaged before
+    try:
+        os.makedirs(hls_dir, exist_ok=True)
+        pipeline.build_hls_output(output_path, hls_dir, app.config['HLS_SEGMENT_SECONDS'])\
+            .run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
+        return playlist_path
+    except ffmpeg.Error as e:
+        # The MP4 is still playable, so a failed package doesn't fail the job
+        print(f"❌ HLS packaging failed for {output_path}: {e.stderr.decode('utf8')}")
+        shutil.rmtree(hls_dir, ignore_errors=True)
+        return None
+
+def process_batch_background(job_id, sources):
+    """Render every source once for all of its presets, tracking each output under the parent job"""
+    should_cancel = active_jobs.get(job_id, {}).get('should_cancel')
+    if not should_cancel:
+        complete_job(job_id, error="Job cancellation system not initialized")
+        return
+    
+    try:
+        outputs = job_outputs(get_job_status(job_id))
+        update_job_progress(job_id, 5, f"Starting batch of {len(outputs)} outputs...", 'processing')
+        
+        def publish_outputs():
+            write_job_fields(job_id, {'outputs': outputs})
+            emit_job_event('batch_output_update', {'job_id': job_id, 'outputs': outputs})
+            overall = sum(output['progress'] for output in outputs) / len(outputs)
+            done = sum(1 for output in outputs if output['status'] in ('completed', 'failed'))
+            update_job_progress(job_id, 5 + int(overall * 0.9), f"{done} of {len(outputs)} outputs finished", 'processing')
+        
+        for source in sources:
+            if should_cancel.is_set():
+                return
+            entries = [outputs[output['index']] for output in source['outputs']]
+            
+            def report_source_progress(fraction, message):
+                percent = int(fraction * 100)
+                if any(entry['progress'] != percent for entry in entries):
+                    for entry in entries:
+                        entry.update(status='processing', progress=percent)
+                    publish_outputs()
+            
+            try:
+                with job_stage(job_id, 'batch_render') as span:
+                    span['bytes_read'] = file_size(source['input_path'])
+                    span['frames'] = source['probe']['total_frames']
+                    finished = render.render_batch(
+                        source['input_path'],
+                        [(output['output_path'], output['options']) for output in source['outputs']],
+                        should_cancel, report_source_progress,
+                        encoder_threads=app.config['ENCODER_THREADS'],
+                        source_info=source['probe']
+                    )
+                    span['bytes_written'] = sum(file_size(output['output_path']) for output in source['outputs'])
+            except render.RenderError as e:
+                for output, entry in zip(source['outputs'], entries):
+                    discard_output(output['output_path'])
+                    entry.update(status='failed', progress=0, error=str(e))
+                publish_outputs()
+                continue
+            if not finished:
+                for output in source['outputs']:
+                    discard_output(output['output_path'])
+                return
+            
+            for output, entry in zip(source['outputs'], entries):
+                output_path = output['output_path']
+                if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+                    discard_output(output_path)
+                    entry.update(status='failed', progress=0, error="Processed file is empty")
+                    continue
+                output_path = result_cache.store(output['options']['cache_key'], output_path)
+                if pipeline.parse_float(output['options'].get('hls', '0'), 0):
+                    package_hls(output_path)
+                entry.update(status='completed', progress=100, output_filename=os.path.basename(output_path))
+            publish_outputs()
         
+        finish_batch(job_id, outputs)
+    
     except Exception as e:
-        # Clean up temp files on error
-        cleanup_temp_files(temp_files)
+        # Completed outputs were moved into the cache; whatever is left at these paths is unfinished
+        for source in sources:
+            for output in source['outputs']:
+                discard_output(output['output_path'])
         complete_job(job_id, error=f"Unexpected error: {str(e)}")
 
+def finish_batch(job_id, outputs):
+    """Complete a batch job; it succeeds if at least one output was rendered"""
+    completed = [output for output in outputs if output['status'] == 'completed']
+    if not completed:
+        complete_job(job_id, error="All batch outputs failed")
+        return
+    failed = len(outputs) - len(completed)
+    message = f"{len(completed)} outputs completed" + (f", {failed} failed" if failed else "")
+    update_job_progress(job_id, 100, message, "completed")
+    complete_job(job_id, output_filename=completed[0]['output_filename'])
+
+def process_job_background(job_id, input_path, output_path, options, original_filename):
+    """Run a dequeued job: a batch submission or a single video"""
+    if options.get('batch'):
+        process_batch_background(job_id, options['batch'])
+    else:
+        process_video_background(job_id, input_path, output_path, options, original_filename)
+
+def run_scheduled_job(job_id, input_path, output_path, options, original_filename):
+    """Scheduler entry point: run a dequeued job unless it was cancelled while waiting"""
+    job_info = active_jobs.get(job_id)
+    if not job_info or job_info['should_cancel'].is_set():
+        active_jobs.pop(job_id, None)
+        return
+    job_info['thread'] = threading.current_thread()
+    try:
+        process_job_background(job_id, input_path, output_path, options, original_filename)
+    finally:
+        active_jobs.pop(job_id, None)
+        storage.release(job_id)
+
+def report_queue_position(job_id, position, queued_total):
+    """Show a waiting job its real place in the queue"""
+    update_job_progress(job_id, 0, f"Queued for processing (position {position} of {queued_total})", 'queued')
+    if REDIS_AVAILABLE:
+        # For status requests that reach another web process
+        write_job_fields(job_id, {'queue_position': position})
+
+job_scheduler = JobScheduler(
+    run_scheduled_job,
+    workers=app.config['MAX_CONCURRENT_JOBS'],
+    max_queued=app.config['MAX_QUEUED_JOBS'],
+    on_position=report_queue_position,
+    max_wait=app.config['MAX_QUEUE_WAIT']
+)
+
+def job_backlog_full():
+    """True when no more jobs should be admitted"""
+    if app.config['JOB_BACKEND'] == 'redis':
+        return sum(redis_client.llen(key) for key in JOB_QUEUE_KEYS) >= app.config['MAX_QUEUED_JOBS']
+    return job_scheduler.is_full()
+
+def submit_job(job_id, input_path, output_path, options, original_filename, priority='normal', cost=0):
+    """Queue a created job on the configured backend; raises QueueFullError when the backlog is full
+
+    cost (pipeline.estimate_cost) orders the local queue within a priority;
+    the Redis queues stay first in, first out.
+    """
+    if app.config['JOB_BACKEND'] == 'redis':
+        if job_backlog_full():
+            raise QueueFullError("Redis job queue is full")
+        payload = {
+            'input_path': input_path,
+            'output_path': output_path,
+            'options': options,
+            'original_filename': original_filename
+        }
+        queue_key = f"jobs:queue:{priority}"
+        if queue_key not in JOB_QUEUE_KEYS:
+            queue_key = 'jobs:queue:normal'
+        # Kept so a job left behind by a dead worker goes back to the same queue
+        payload['queue_key'] = queue_key
+        redis_client.set(f"job:{job_id}:payload", json.dumps(payload))
+        redis_client.rpush(queue_key, job_id)
+        return
+    
+    # Register job in active jobs tracking; the thread is set once a worker picks it up
+    active_jobs[job_id] = {
+        'thread': None,
+        'should_cancel': threading.Event()
+    }
+    try:
+        job_scheduler.submit(job_id, (input_path, output_path, options, original_filename),
+                             priority=priority, cost=cost)
+    except QueueFullError:
+        del active_jobs[job_id]
+        raise
+
+def worker_job_ids():
+    """Ids of the jobs live workers are processing; a dead worker's list no longer counts"""
+    job_ids = set()
+    for worker_id in redis_client.smembers(JOB_WORKERS_KEY):
+        if redis_client.exists(WORKER_HEARTBEAT_PREFIX + worker_id):
+            job_ids.update(redis_client.lrange(JOB_PROCESSING_PREFIX + worker_id, 0, -1))
+    return job_ids
+
+def queue_position(job_id):
+    """1-based position of a waiting job on the configured backend, or None"""
+    if app.config['JOB_BACKEND'] == 'redis':
+        jobs_ahead = 0
+        for key in JOB_QUEUE_KEYS:
+            index = redis_client.lpos(key, job_id)
+            if index is not None:
+                return jobs_ahead + index + 1
+            jobs_ahead += redis_client.llen(key)
+        return None
+    position = job_scheduler.position(job_id)
+    if position is None and REDIS_AVAILABLE:
+        # Queued in another web process, which stores the position it last reported
+        stored = redis_client.hget(f"job:{job_id}", 'queue_position')
+        return int(stored) if stored else None
+    return position
+
+if app.config['JOB_BACKEND'] == 'local':
+    job_scheduler.start()
+if REDIS_AVAILABLE and not app.config['PUBLISH_EVENTS_TO_REDIS']:
+    # Web process: relay worker progress to browsers and cancellations from other web processes
+    socketio.start_background_task(relay_redis_events)
+
+class InvalidOptionsError(Exception):
+    """Processing options that can't be used; reported to the client as a 400"""
+
+def parse_segments(value):
+    """Number of parallel segments, clamped to 1..MAX_SEGMENTS"""
+    try:
+        count = float(value)
+    except (TypeError, ValueError):
+        raise InvalidOptionsError("segments must be a number")
+    if not math.isfinite(count):
+        raise InvalidOptionsError("segments must be a finite number")
+    return max(1, min(int(count), app.config['MAX_SEGMENTS']))
+
+def options_from_form(form):
+    """Processing options submitted with an upload; raises InvalidOptionsError"""
+    return {
+        'transformation': form.get('transformation', 'none'),
+        'filter': form.get('filter', 'none'),
+        'speed': form.get('speed', '1.0'),
+        'brightness': form.get('brightness', '1.0'),
+        'contrast': form.get('contrast', '1.0'),
+        'segments': parse_segments(form.get('segments', '1')),
+        'hls': form.get('hls', '1' if app.config['HLS_OUTPUT'] else '0'),
+        'profile': form.get('profile', app.config['DEFAULT_ENCODER_PROFILE'])
+    }
+
+def render_engine(options):
+    """Which pipeline renders these options (part of the cache key)"""
+    return 'opencv' if app.config['OPENCV_FRAME_FILTERS'] and options.get('filter', 'none') != 'none' else 'ffmpeg'
+
+def start_uploaded_job(job_id, input_path, output_path, options, original_filename, priority, content_hash=None,
+                       upload_span=None):
+    """Create and queue a job for a stored upload, or finish it from the result cache
+
+    upload_span is the stage span of saving the upload, recorded once the job
+    exists. A complete upload is probed first; the probe travels with the
+    options so the render doesn't open the file again, and its cost estimate
+    orders the queue. Raises QueueFullError (after failing the job) when the
+    backlog is full.
+    """
+    if content_hash:
+        options['cache_key'] = make_cache_key(content_hash, options, render_engine(options))
+        
+        # Same bytes and options as an earlier job: finish at once with the stored result
+        extension = os.path.splitext(output_path)[1]
+        cached_filename = result_cache.lookup(options['cache_key'], extension)
+        if cached_filename:
+            print(f"Cache hit for {original_filename}, reusing {cached_filename}")
+            cleanup_temp_files([input_path])
+            create_job(job_id, original_filename, options)
+            if upload_span:
+                record_stage(job_id, upload_span)
+            if pipeline.parse_float(options.get('hls', '0'), 0):
+                package_hls(result_cache.path_for(options['cache_key'], extension))
+            update_job_progress(job_id, 100, "Result served from cache", "completed")
+            complete_job(job_id, output_filename=cached_filename)
+            return
+    
+    # The input is kept (and protected from eviction) until the job releases it
+    storage.add(input_path, job_id)
+
+    cost = 0
+    probe_error = None
+    if not options.get('upload_length'):
+        # A streaming upload is still incomplete and is rendered without a probe
+        try:
+            options['probe'] = probe_input(input_path)
+            cost = pipeline.estimate_cost(options, options['probe'])
+        except ProbeError as e:
+            probe_error = str(e)
+    
+    # Create job
+    create_job(job_id, original_filename, options)
+    if upload_span:
+        record_stage(job_id, upload_span)
+    if probe_error:
+        # Not a video we can read: fail now instead of after waiting in the queue
+        complete_job(job_id, error=probe_error)
+        cleanup_temp_files([input_path])
+        return
+    
+    try:
+        submit_job(job_id, input_path, output_path, options, original_filename, priority=priority, cost=cost)
+    except QueueFullError:
+        complete_job(job_id, error="Processing queue is full")
+        cleanup_temp_files([input_path])
+        raise
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
@@ -575,54 +834,139 @@ def index():
         if file.filename == '':
             return redirect(request.url)
         if file and allowed_file(file.filename):
+            # Admission control: refuse new work before storing the upload
+            if job_backlog_full():
+                return "Too many videos are waiting to be processed, please try again later", 429
+            
+            # Get processing options from form
+            try:
+                options = options_from_form(request.form)
+            except InvalidOptionsError as e:
+                return str(e), 400
+            
             original_filename = file.filename
             job_id = str(uuid.uuid4())
             input_filename = job_id + "_" + original_filename
             input_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
-            file.save(input_path)
-            
-            # Clean up old videos when new upload happens
-            print(f"New video uploaded: {original_filename}, cleaning up old videos...")
-            cleanup_old_videos(max_files=app.config['MAX_STORED_VIDEOS'])
+            upload_spans = []
+            with stage_span('upload_save', upload_spans.append) as span:
+                content_hash = save_and_hash(file, input_path)
+                span['bytes_written'] = file_size(input_path)
 
             output_filename = "processed_" + input_filename
             output_path = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
-
-            # Get processing options from form
-            options = {
-                'transformation': request.form.get('transformation', 'none'),
-                'filter': request.form.get('filter', 'none'),
-                'speed': request.form.get('speed', '1.0'),
-                'brightness': request.form.get('brightness', '1.0'),
-                'contrast': request.form.get('contrast', '1.0')
-            }
-
-            # Create job
-            create_job(job_id, original_filename, options)
             
-            # Initialize cancellation system
-            cancel_event = threading.Event()
-            
-            # Start background processing
-            thread = threading.Thread(
-                target=process_video_background,
-                args=(job_id, input_path, output_path, options, original_filename)
-            )
-            thread.daemon = True
-            
-            # Register job in active jobs tracking
-            active_jobs[job_id] = {
-                'thread': thread,
-                'should_cancel': cancel_event
-            }
-            
-            thread.start()
+            try:
+                start_uploaded_job(job_id, input_path, output_path, options, original_filename,
+                                   request.form.get('priority', 'normal'), content_hash,
+                                   upload_span=upload_spans[0])
+            except QueueFullError:
+                return "Too many videos are waiting to be processed, please try again later", 429
             
             # Return job status page instead of direct redirect
             return redirect(url_for('job_status', job_id=job_id))
             
     return render_template('index.html')
 
+def upload_status(session):
+    """JSON view of an upload session"""
+    return {
+        'upload_id': session['id'],
+        'offset': session['offset'],
+        'length': session['length'],
+        'complete': session['offset'] >= session['length'],
+        'job_id': session['id'] if session['job_started'] else None,
+        'job_url': url_for('job_status', job_id=session['id']) if session['job_started'] else None
+    }
+
+def can_stream_upload(session):
+    """Whether processing can start before all chunks have arrived"""
+    options = session['options']
+    return (session['stream'] and render_engine(options) == 'ffmpeg' and
+            int(options.get('segments', 1)) <= 1)
+
+@app.route('/api/uploads', methods=['POST'])
+def api_create_upload():
+    """Start a chunked, resumable upload"""
+    data = request.get_json(silent=True) or {}
+    filename = os.path.basename(str(data.get('filename', '')))
+    try:
+        length = int(data.get('length', 0))
+    except (TypeError, ValueError):
+        length = 0
+    
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'Unsupported file type'}), 400
+    if length <= 0 or length > app.config['MAX_UPLOAD_LENGTH']:
+        return jsonify({'error': f"Upload length must be between 1 and {app.config['MAX_UPLOAD_LENGTH']} bytes"}), 413
+    try:
+        options = options_from_form(data.get('options') or {})
+    except InvalidOptionsError as e:
+        return jsonify({'error': str(e)}), 400
+    if job_backlog_full():
+        return jsonify({'error': 'Too many videos are waiting to be processed, please try again later'}), 429
+    
+    upload_id = str(uuid.uuid4())
+    input_path = os.path.join(app.config['UPLOAD_FOLDER'], upload_id + "_" + filename)
+    session = upload_store.create(
+        upload_id, input_path, filename, length,
+        options,
+        priority=data.get('priority', 'normal'),
+        stream=bool(data.get('stream', False))
+    )
+    response = jsonify(upload_status(session))
+    response.status_code = 201
+    response.headers['Location'] = url_for('api_upload', upload_id=upload_id)
+    return response
+
+@app.route('/api/uploads/<upload_id>', methods=['HEAD', 'GET', 'PATCH'])
+def api_upload(upload_id):
+    """Report an upload's offset (HEAD/GET) or append a chunk at Upload-Offset (PATCH)"""
+    session = upload_store.get(upload_id)
+    if not session:
+        return jsonify({'error': 'Upload not found'}), 404
+    
+    if request.method == 'PATCH':
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return jsonify({'error': 'Upload-Offset header is required'}), 400
+        try:
+            session = upload_store.append(upload_id, offset, request.stream)
+        except UploadError as e:
+            return jsonify({'error': str(e), **upload_status(session)}), e.status
+        
+        complete = session['offset'] >= session['length']
+        if not session['job_started']:
+            output_path = os.path.join(app.config['PROCESSED_FOLDER'], "processed_" + os.path.basename(session['path']))
+            streamable = None
+            if can_stream_upload(session) and (complete or session['offset'] >= app.config['STREAM_START_BYTES']):
+                streamable = is_streamable_prefix(session['path'], session['filename'])
+            try:
+                if streamable and not complete:
+                    # Process the bytes as they arrive; the result can't be cached without the full hash
+                    session['options']['upload_length'] = session['length']
+                    session['job_started'] = True
+                    start_uploaded_job(upload_id, session['path'], output_path, session['options'],
+                                       session['filename'], session['priority'])
+                elif complete:
+                    session['job_started'] = True
+                    start_uploaded_job(upload_id, session['path'], output_path, session['options'],
+                                       session['filename'], session['priority'],
+                                       UploadStore.content_hash(session))
+            except QueueFullError:
+                upload_store.remove(upload_id)
+                return jsonify({'error': 'Too many videos are waiting to be processed, please try again later'}), 429
+        
+        if complete:
+            upload_store.remove(upload_id)
+    
+    response = jsonify(upload_status(session))
+    response.headers['Upload-Offset'] = str(session['offset'])
+    response.headers['Upload-Length'] = str(session['length'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 @app.route('/job/<job_id>')
 def job_status(job_id):
     """Show job status page with real-time progress"""
@@ -637,6 +981,11 @@ def api_job_status(job_id):
     job = get_job_status(job_id)
     if not job:
         return jsonify({'error': 'Job not found'}), 404
+    if job.get('status') == 'queued':
+        job['queue_position'] = queue_position(job_id)
+    if job.get('outputs'):
+        job['outputs'] = job_outputs(job)
+    job['stages'] = job_stages(job)
     return jsonify(job)
 
 @app.route('/api/job/<job_id>/cancel', methods=['POST'])
@@ -648,11 +997,199 @@ def api_cancel_job(job_id):
     else:
         return jsonify({'error': 'Job not found or already completed'}), 404
 
+@app.route('/api/cache/stats')
+def api_cache_stats():
+    """API endpoint with result cache hit/miss statistics"""
+    return jsonify(result_cache.stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint: stage timings, queue depth, active jobs and Redis latency"""
+    if app.config['JOB_BACKEND'] == 'redis':
+        queued = sum(redis_client.llen(key) for key in JOB_QUEUE_KEYS)
+        active = len(worker_job_ids())
+    else:
+        queued = job_scheduler.queue_depth()
+        active = job_scheduler.running_count()
+    if app.config['JOB_BACKEND'] == 'redis':
+        take_worker_stages()
+    storage_stats = storage.stats()
+    gauges = [
+        ('video_jobs_queued', 'Jobs waiting for a worker', queued),
+        ('video_jobs_active', 'Jobs being processed', active),
+        ('video_storage_bytes', 'Bytes of uploads and uncached outputs', storage_stats['bytes']),
+        ('video_storage_files', 'Uploads and uncached outputs on disk', storage_stats['files']),
+    ]
+    if REDIS_AVAILABLE:
+        started = time.perf_counter()
+        try:
+            redis_client.ping()
+            gauges.append(('video_redis_up', 'Whether Redis answered the scrape\'s PING', 1))
+            gauges.append(('video_redis_latency_seconds', 'Round trip of a Redis PING', round(time.perf_counter() - started, 6)))
+        except redis.RedisError:
+            gauges.append(('video_redis_up', 'Whether Redis answered the scrape\'s PING', 0))
+    return Response(stage_metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/batch', methods=['POST'])
+def api_create_batch():
+    """API endpoint: render every uploaded file with every preset under one parent job
+
+    Multipart fields: one or more `file`, `presets` (JSON list of option
+    objects) and optional `priority`.
+    """
+    files = [file for file in request.files.getlist('file') if file and file.filename]
+    if not files or not all(allowed_file(file.filename) for file in files):
+        return jsonify({'error': 'At least one video file (mp4, avi, mov, mkv) is required'}), 400
+    try:
+        presets = json.loads(request.form.get('presets', '[]'))
+    except ValueError:
+        return jsonify({'error': 'presets must be a JSON list of option objects'}), 400
+    if not isinstance(presets, list) or not presets or not all(isinstance(preset, dict) for preset in presets):
+        return jsonify({'error': 'presets must be a JSON list of option objects'}), 400
+    if len(files) * len(presets) > app.config['MAX_BATCH_OUTPUTS']:
+        return jsonify({'error': f"A batch may produce at most {app.config['MAX_BATCH_OUTPUTS']} outputs"}), 400
+    try:
+        presets = [options_from_form(preset) for preset in presets]
+    except InvalidOptionsError as e:
+        return jsonify({'error': str(e)}), 400
+    if job_backlog_full():
+        return jsonify({'error': 'Too many videos are waiting to be processed, please try again later'}), 429
+    
+    job_id = str(uuid.uuid4())
+    outputs = []  # one entry per file x preset, in that order
+    sources = []  # inputs that still have outputs to render
+    upload_spans = []
+    for source_index, file in enumerate(files):
+        input_filename = f"{job_id}_{source_index}_{file.filename}"
+        input_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
+        with stage_span('upload_save', upload_spans.append) as span:
+            content_hash = save_and_hash(file, input_path)
+            span['bytes_written'] = file_size(input_path)
+        
+        pending = []
+        for preset_index, preset in enumerate(presets):
+            # Batches always render with FFmpeg so that the presets share one decode
+            cache_key = make_cache_key(content_hash, preset, 'ffmpeg')
+            cached_filename = result_cache.lookup(cache_key, os.path.splitext(input_filename)[1])
+            outputs.append({
+                'source': file.filename,
+                'preset': preset_index,
+                'status': 'completed' if cached_filename else 'queued',
+                'progress': 100 if cached_filename else 0,
+                'output_filename': cached_filename,
+                'error': None
+            })
+            if not cached_filename:
+                pending.append({
+                    'index': len(outputs) - 1,
+                    'output_path': os.path.join(app.config['PROCESSED_FOLDER'], f"processed_p{preset_index}_{input_filename}"),
+                    'options': dict(preset, cache_key=cache_key)
+                })
+        if pending:
+            try:
+                probe = probe_input(input_path)
+            except ProbeError as e:
+                for output in pending:
+                    outputs[output['index']].update(status='failed', error=str(e))
+                cleanup_temp_files([input_path])
+                continue
+            storage.add(input_path, job_id)
+            sources.append({'input_path': input_path, 'original_filename': file.filename, 'outputs': pending,
+                            'probe': probe})
+        else:
+            cleanup_temp_files([input_path])
+    
+    batch_name = f"Batch: {len(files)} file(s) x {len(presets)} preset(s)"
+    create_job(job_id, batch_name, {'presets': presets})
+    write_job_fields(job_id, {'outputs': outputs})
+    for span in upload_spans:
+        record_stage(job_id, span)
+    if not sources:
+        # Every output was already cached or can't be rendered
+        finish_batch(job_id, outputs)
+    else:
+        cost = sum(pipeline.estimate_cost(output['options'], source['probe'])
+                   for source in sources for output in source['outputs'])
+        try:
+            submit_job(job_id, None, None, {'batch': sources}, batch_name,
+                       priority=request.form.get('priority', 'normal'), cost=cost)
+        except QueueFullError:
+            complete_job(job_id, error="Processing queue is full")
+            cleanup_temp_files([source['input_path'] for source in sources])
+            return jsonify({'error': 'Too many videos are waiting to be processed, please try again later'}), 429
+    
+    return jsonify({
+        'job_id': job_id,
+        'status_url': url_for('api_job_status', job_id=job_id),
+        'outputs': outputs
+    }), 202
+
+@app.route('/api/preview/sources', methods=['POST'])
+def api_create_preview_source():
+    """API endpoint: upload a video once and get a source id for previews"""
+    file = request.files.get('file')
+    if not file or not file.filename or not allowed_file(file.filename):
+        return jsonify({'error': 'A video file (mp4, avi, mov, mkv) is required'}), 400
+    try:
+        source_id = preview_store.add_source(file)
+    except PreviewBusyError as e:
+        return jsonify({'error': str(e)}), 429
+    except render.RenderError as e:
+        return jsonify({'error': str(e)}), 422
+    return jsonify({
+        'source_id': source_id,
+        'seconds': app.config['PREVIEW_SECONDS'],
+        'height': app.config['PREVIEW_HEIGHT']
+    }), 201
+
+@app.route('/api/preview/<source_id>', methods=['POST'])
+def api_render_preview(source_id):
+    """API endpoint: render the preview source with options (JSON or form fields)"""
+    if not preview_store.has_source(source_id):
+        return jsonify({'error': 'Preview source not found, upload it again'}), 404
+    try:
+        options = options_from_form(request.get_json(silent=True) or request.form)
+    except InvalidOptionsError as e:
+        return jsonify({'error': str(e)}), 400
+    options['profile'] = app.config['PREVIEW_ENCODER_PROFILE']
+    started = time.time()
+    try:
+        filename = preview_store.render(
+            source_id, options, render_engine(options),
+            opencv_frame_filters=app.config['OPENCV_FRAME_FILTERS'],
+            frame_workers=app.config['FRAME_WORKERS'],
+            metadata_rotation=app.config['METADATA_ROTATION']
+        )
+    except PreviewSourceMissingError:
+        return jsonify({'error': 'Preview source not found, upload it again'}), 404
+    except PreviewBusyError as e:
+        return jsonify({'error': str(e)}), 429
+    except render.RenderError as e:
+        return jsonify({'error': str(e)}), 422
+    return jsonify({
+        'url': url_for('preview_file', filename=filename),
+        'render_seconds': round(time.time() - started, 3)
+    })
+
+@app.route('/previews/<filename>')
+def preview_file(filename):
+    return send_from_directory(PREVIEW_FOLDER, filename, conditional=True,
+                               max_age=app.config['PROCESSED_MAX_AGE'])
+
 @app.route('/play/<filename>')
 def play_video(filename):
     expected_path = os.path.join(app.config['PROCESSED_FOLDER'], filename)
     if os.path.exists(expected_path):
-        return render_template('video_player.html', filename=filename)
+        storage.touch(expected_path)
+        hls_playlist = pipeline.hls_dir_name(filename) + '/' + pipeline.HLS_PLAYLIST
+        if not os.path.exists(os.path.join(app.config['PROCESSED_FOLDER'], hls_playlist)):
+            hls_playlist = None
+        thumbnails_dir = pipeline.thumbnails_dir_name(filename)
+        if not os.path.exists(os.path.join(app.config['PROCESSED_FOLDER'], thumbnails_dir, thumbnails.VTT_FILENAME)):
+            thumbnails_dir = None
+        return render_template('video_player.html', filename=filename, hls_playlist=hls_playlist,
+                               thumbnails_dir=thumbnails_dir, poster=thumbnails.POSTER_FILENAME,
+                               thumbnails_vtt=thumbnails.VTT_FILENAME)
     return "Video not found", 404
 
 @app.route('/processed/<filename>')
@@ -661,7 +1198,28 @@ def processed_file(filename):
     if not os.path.exists(file_path):
         from flask import abort
         abort(404, "Processed video not found.")
-    return send_from_directory(app.config['PROCESSED_FOLDER'], filename)
+    storage.touch(file_path)
+    # Conditional responses: Range requests get 206 partial content, ETag/Last-Modified revalidate with 304
+    return send_from_directory(app.config['PROCESSED_FOLDER'], filename, conditional=True,
+                               max_age=app.config['PROCESSED_MAX_AGE'])
+
+@app.route('/hls/<path:filename>')
+def hls_file(filename):
+    """Serve HLS playlists and segments generated next to processed videos"""
+    if not filename.startswith(pipeline.HLS_DIR_PREFIX):
+        from flask import abort
+        abort(404)
+    return send_from_directory(app.config['PROCESSED_FOLDER'], filename, conditional=True,
+                               max_age=app.config['PROCESSED_MAX_AGE'])
+
+@app.route('/thumbnails/<path:filename>')
+def thumbnail_file(filename):
+    """Serve posters, thumbnail sprites and their WebVTT indexes generated next to processed videos"""
+    if not filename.startswith(pipeline.THUMBNAILS_DIR_PREFIX):
+        from flask import abort
+        abort(404)
+    return send_from_directory(app.config['PROCESSED_FOLDER'], filename, conditional=True,
+                               max_age=app.config['PROCESSED_MAX_AGE'])
 
 # SocketIO Events
 @socketio.on('connect')
@@ -671,6 +1229,8 @@ def handle_connect():
 @socketio.on('join_job')
 def handle_join_job(data):
     job_id = data['job_id']
+    # Progress and completion events are emitted to the job's room only
+    join_room(job_id)
     # Send current job status to the newly connected client
     job = get_job_status(job_id)
     if job:
@@ -0,0 +1 @@
+"""Benchmarks of the rendering pipeline on synthetic clips (`python -m bench.run`)"""
@@ -0,0 +1,51 @@
+"""Synthetic benchmark inputs generated locally with FFmpeg's lavfi sources
+
+testsrc2 has moving content in every frame, so encoders can't coast on
+static images, and the clips are the same bit for bit on every machine
+with the same FFmpeg build.
+"""
+import os
+
+import ffmpeg
+
+# name -> (width, height, seconds, with audio)
+CLIPS = {
+    '480p_audio_10s': (854, 480, 10, True),
+    '480p_silent_30s': (854, 480, 30, False),
+    '720p_audio_10s': (1280, 720, 10, True),
+    '720p_silent_5s': (1280, 720, 5, False),
+    '1080p_audio_5s': (1920, 1080, 5, True),
+    '1080p_silent_10s': (1920, 1080, 10, False),
+}
+QUICK_CLIPS = ['480p_audio_10s']
+CLIP_FPS = 30
+
+
+def clip_path(directory, name):
+    return os.path.join(directory, f"{name}.mp4")
+
+
+def generate_clip(path, width, height, seconds, audio):
+    """Encode a testsrc2 clip (plus a 440 Hz sine track if audio) the way uploads usually arrive"""
+    video = ffmpeg.input(f'testsrc2=size={width}x{height}:rate={CLIP_FPS}', f='lavfi', t=seconds)
+    streams = [video]
+    if audio:
+        streams.append(ffmpeg.input('sine=frequency=440:sample_rate=48000', f='lavfi', t=seconds))
+    partial_path = path + '.partial.mp4'
+    ffmpeg.output(*streams, partial_path, vcodec='libx264', preset='veryfast', pix_fmt='yuv420p',
+                  g=2 * CLIP_FPS, acodec='aac')\
+          .run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
+    os.replace(partial_path, path)
+
+
+def ensure_clips(directory, names):
+    """Generate the named clips that aren't in directory yet; returns {name: path}"""
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for name in names:
+        path = clip_path(directory, name)
+        if not os.path.exists(path):
+            print(f"🎞️ Generating {name}...")
+            generate_clip(path, *CLIPS[name])
+        paths[name] = path
+    return paths
@@ -0,0 +1,225 @@
+"""Run the pipeline over synthetic clips and report speed and resource use as JSON
+
+    python -m bench.run --quick
+    python -m bench.run --baseline bench/baseline.json --write-baseline
+    python -m bench.run --baseline bench/baseline.json
+
+Every transformation x filter x speed combination is rendered from every
+clip with render.render_video (or segments.render_segmented), without the
+Flask app. Each case runs in a fresh process so that its peak RSS (its own
+and FFmpeg's) isn't hidden by earlier cases. With --baseline, cases whose
+fps dropped or whose peak RSS grew by more than --tolerance are reported
+and the exit status is 1.
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import pipeline
+import render
+import segments
+from bench.clips import CLIPS, QUICK_CLIPS, ensure_clips
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TRANSFORMATIONS = ['none'] + list(pipeline.TRANSFORM_FILTERS)
+FILTERS = ['none'] + list(pipeline.FRAME_FILTERS)
+SPEEDS = ['0.25', '0.5', '1.0', '1.5', '2.0']  # the choices of the upload form
+TEMP_POLL_INTERVAL = 0.05  # seconds between temp disk samples
+
+
+def combinations(quick=False):
+    """(transformation, filter, speed) cases; quick varies one option at a time"""
+    if not quick:
+        return list(itertools.product(TRANSFORMATIONS, FILTERS, SPEEDS))
+    cases = [(transformation, 'none', '1.0') for transformation in TRANSFORMATIONS]
+    cases += [('none', selected_filter, '1.0') for selected_filter in FILTERS[1:]]
+    cases += [('none', 'none', speed) for speed in SPEEDS if speed != '1.0']
+    return cases
+
+
+def ignore_progress(fraction, message):
+    pass
+
+
+def directory_size(directory):
+    total = 0
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(root, filename))
+            except FileNotFoundError:
+                pass  # removed while walking
+    return total
+
+
+def run_case(input_path, options, settings):
+    """Render one case in this process and measure it; runs in a fresh worker process"""
+    work_dir = tempfile.mkdtemp(prefix='bench_')
+    # Segment files and any other temporaries land where they are measured
+    tempfile.tempdir = work_dir
+    output_path = os.path.join(work_dir, 'output.mp4')
+    peak_temp = [0]
+    stop = threading.Event()
+
+    def watch_temp_disk():
+        while not stop.wait(TEMP_POLL_INTERVAL):
+            peak_temp[0] = max(peak_temp[0], directory_size(work_dir))
+
+    watcher = threading.Thread(target=watch_temp_disk)
+    watcher.daemon = True
+    watcher.start()
+    try:
+        frames = render.read_stream_info(input_path)['total_frames']
+        started = time.perf_counter()
+        if settings['segments'] > 1:
+            segments.render_segmented(input_path, output_path, options, threading.Event(), ignore_progress,
+                                      settings['segments'], opencv_frame_filters=settings['opencv'])
+        else:
+            render.render_video(input_path, output_path, options, threading.Event(),
+                                opencv_frame_filters=settings['opencv'],
+                                metadata_rotation=settings['metadata_rotation'])
+        wall = time.perf_counter() - started
+        stop.set()
+        watcher.join()
+        output_bytes = os.path.getsize(output_path)
+        peak_temp[0] = max(peak_temp[0], directory_size(work_dir))
+    finally:
+        stop.set()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # ru_maxrss is in KiB on Linux; children covers FFmpeg and segment processes
+    own_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    return {
+        'frames': frames,
+        'wall_seconds': round(wall, 4),
+        'fps': round(frames / wall, 2) if wall > 0 else 0.0,
+        'peak_rss_bytes': max(own_rss, children_rss),
+        'peak_temp_bytes': peak_temp[0],
+        'output_bytes': output_bytes,
+    }
+
+
+def run_benchmark(clip_paths, cases, settings):
+    """Run every case on every clip and return the report"""
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'host': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+        },
+        'settings': settings,
+        'cases': [],
+    }
+    context = multiprocessing.get_context('spawn')
+    for clip_name, input_path in clip_paths.items():
+        for transformation, selected_filter, speed in cases:
+            options = {'transformation': transformation, 'filter': selected_filter, 'speed': speed,
+                       'profile': settings['profile']}
+            case_id = f"{clip_name}/{transformation}/{selected_filter}/{speed}x"
+            # One process per case keeps the RSS high-water marks separate
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                try:
+                    result = executor.submit(run_case, input_path, options, settings).result()
+                except render.RenderError as e:
+                    print(f"❌ {case_id}: {e}")
+                    report['cases'].append({'id': case_id, 'error': str(e)})
+                    continue
+            print(f"⏱️ {case_id}: {result['fps']:.1f} fps, {result['wall_seconds']:.2f}s, "
+                  f"{result['peak_rss_bytes'] / (1024*1024):.0f} MB RSS, "
+                  f"{result['peak_temp_bytes'] / (1024*1024):.1f} MB temp")
+            report['cases'].append(dict(result, id=case_id, clip=clip_name, transformation=transformation,
+                                        filter=selected_filter, speed=speed))
+    return report
+
+
+def compare(report, baseline, tolerance):
+    """Regressions of report against baseline: fps lower or peak RSS higher by more than tolerance"""
+    baseline_cases = {case['id']: case for case in baseline['cases'] if 'error' not in case}
+    regressions = []
+    for case in report['cases']:
+        previous = baseline_cases.get(case['id'])
+        if not previous:
+            continue
+        if 'error' in case:
+            regressions.append(f"{case['id']}: failed ({case['error'][:80]})")
+            continue
+        if case['fps'] < previous['fps'] * (1 - tolerance):
+            regressions.append(f"{case['id']}: {case['fps']:.1f} fps, baseline {previous['fps']:.1f}")
+        if case['peak_rss_bytes'] > previous['peak_rss_bytes'] * (1 + tolerance):
+            regressions.append(f"{case['id']}: {case['peak_rss_bytes'] / (1024*1024):.0f} MB RSS, "
+                               f"baseline {previous['peak_rss_bytes'] / (1024*1024):.0f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the rendering pipeline on synthetic clips")
+    parser.add_argument('--quick', action='store_true',
+                        help="one clip, and each option varied on its own instead of every combination")
+    parser.add_argument('--clips', help=f"comma-separated clip names (default: all of {', '.join(CLIPS)})")
+    parser.add_argument('--clips-dir', default=os.path.join(BENCH_DIR, 'clips'),
+                        help="where generated clips are kept between runs")
+    parser.add_argument('--output', help="report path (default: bench/results/<timestamp>.json)")
+    parser.add_argument('--baseline', help="report to compare against")
+    parser.add_argument('--write-baseline', action='store_true', help="store this run as the --baseline")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="relative fps drop or RSS growth counted as a regression")
+    parser.add_argument('--profile', default=pipeline.DEFAULT_ENCODER_PROFILE, choices=list(pipeline.ENCODER_PROFILES))
+    parser.add_argument('--segments', type=int, default=1, help="render in this many parallel segments")
+    parser.add_argument('--opencv', action='store_true', help="run filters in the OpenCV frame loop")
+    parser.add_argument('--metadata-rotation', action='store_true',
+                        help="let rotation-only cases rewrite the display matrix")
+    args = parser.parse_args()
+
+    clip_names = args.clips.split(',') if args.clips else (QUICK_CLIPS if args.quick else list(CLIPS))
+    unknown = [name for name in clip_names if name not in CLIPS]
+    if unknown:
+        parser.error(f"unknown clips: {', '.join(unknown)}")
+
+    settings = {
+        'profile': args.profile,
+        'segments': args.segments,
+        'opencv': args.opencv,
+        'metadata_rotation': args.metadata_rotation,
+    }
+    clip_paths = ensure_clips(args.clips_dir, clip_names)
+    report = run_benchmark(clip_paths, combinations(args.quick), settings)
+
+    output_path = args.output or os.path.join(BENCH_DIR, 'results', f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"📄 Report written to {output_path}")
+
+    if not args.baseline:
+        return 0
+    if args.write_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"📌 Baseline written to {args.baseline}")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('settings') != settings:
+        print(f"⚠️ Baseline was run with {baseline.get('settings')}, this run with {settings}")
+    regressions = compare(report, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"📉 {regression}")
+    print(f"{'❌' if regressions else '✅'} {len(regressions)} regression(s) against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Per-frame OpenCV operations used by the frame processing stage
+
+A job's transformation, brightness/contrast and filter are built into one
+op chain that runs on each decoded BGR frame, in the same order as the
+FFmpeg filter graph in pipeline.py, so no FFmpeg pre-pass is needed.
+
+Accuracy against the FFmpeg graph, per 8-bit BGR channel: flips and right-angle
+rotations are exact; invert and grayscale stay within 4 levels and
+brightness/contrast within 8 (mean under 5). Colors outside the RGB gamut
+can differ more, because FFmpeg adjusts YUV values that BGR frames have
+already clipped.
+"""
+import cv2
+import numpy as np
+
+from pipeline import parse_factor
+
+FLIP_CODES = {'hflip': 1, 'vflip': 0, 'rotate180': -1}  # rotate180 is a flip on both axes, done in place
+ROTATE_CODES = {'rotate90': cv2.ROTATE_90_CLOCKWISE, 'rotate270': cv2.ROTATE_90_COUNTERCLOCKWISE}
+
+# Limited-range luma of BGR level i (BT.601) and back
+_LUMA_SCALE = 219 / 255
+
+# Filter kernels, built once rather than per frame. The blur is a separable
+# 15-tap Gaussian (sigma from the size, as cv2.GaussianBlur(frame, (15, 15), 0)
+# picks it); two 1-D passes with it run faster than GaussianBlur, within 1 level
+BLUR_KERNEL = cv2.getGaussianKernel(15, 0)
+SHARPEN_KERNEL = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]], dtype=np.float32)
+CANNY_THRESHOLDS = (100, 200)
+
+
+def eq_lut(brightness, contrast, limited_range=True):
+    """256-entry LUT reproducing FFmpeg's eq=brightness:contrast on a luma plane
+
+    eq maps luma Y to 256 * (contrast * (Y/255 - 0.5) + 0.5 + brightness), truncated.
+    FFmpeg applies it to limited-range Y of YUV video, so for full-range luma
+    (OpenCV's YCrCb) the table converts there and back; a gray plane is
+    already full range.
+    """
+    luma = np.arange(256, dtype=np.float64)
+    if limited_range:
+        luma = 16 + luma * _LUMA_SCALE
+    luma = np.floor(np.clip(256 * (contrast * (luma / 255 - 0.5) + 0.5 + brightness), 0, 255))
+    if limited_range:
+        luma = (luma - 16) / _LUMA_SCALE
+    return np.clip(np.rint(luma), 0, 255).astype(np.uint8)
+
+
+def eq_params(options):
+    """FFmpeg eq (brightness, contrast) for the options, or None if both are neutral"""
+    brightness = parse_factor(options, 'brightness')
+    contrast = parse_factor(options, 'contrast')
+    if brightness == 1.0 and contrast == 1.0:
+        return None
+    # Same mapping of the form value as pipeline.eq_filters
+    return brightness - 1.0, contrast
+
+
+def output_size(options, width, height):
+    """Frame size after the transformation: 90/270 degree rotations swap the axes"""
+    if options.get('transformation') in ROTATE_CODES:
+        return height, width
+    return width, height
+
+
+class FrameOp:
+    """A job's per-frame op chain, built once per job
+
+    Lookup tables and kernels are made here, and every step writes into
+    preallocated buffers instead of allocating its result. Frames in flight
+    at the same time each need their own set from new_buffers(); op(frame,
+    buffers) then takes a decoded BGR frame, which it may modify in place,
+    and returns the processed frame: either frame itself or one of the
+    buffers, valid until that set is used again.
+    """
+
+    def __init__(self, options, width, height):
+        transformation = options.get('transformation', 'none')
+        self.width, self.height = width, height
+        output_width, output_height = output_size(options, width, height)
+        self.output_shape = (output_height, output_width, 3)
+        self.selected_filter = options.get('filter', 'none')
+        self.grayscale = transformation == 'grayscale'
+        self.invert_lut = (255 - np.arange(256)).astype(np.uint8) if transformation == 'invert' else None
+        self.flip_code = FLIP_CODES.get(transformation)
+        self.rotate_code = ROTATE_CODES.get(transformation)
+
+        eq = eq_params(options)
+        self.gray_lut = self.luma_lut = None
+        if eq and self.grayscale:
+            self.gray_lut = eq_lut(*eq, limited_range=False)
+        elif eq:
+            # eq only touches luma: map Y of YCrCb and pass chroma through, in one LUT call
+            luma_lut = np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1)
+            luma_lut[:, 0] = eq_lut(*eq)
+            self.luma_lut = luma_lut.reshape(256, 1, 3)
+
+    def new_buffers(self):
+        """Scratch and output buffers for one frame in flight"""
+        buffers = {}
+        if self.grayscale or self.selected_filter == 'edge_detect':
+            buffers['gray'] = np.empty(self.output_shape[:2], dtype=np.uint8)
+        if self.selected_filter == 'edge_detect':
+            buffers['edges'] = np.empty(self.output_shape[:2], dtype=np.uint8)
+        if self.luma_lut is not None:
+            buffers['ycrcb'] = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        if self.rotate_code is not None:
+            buffers['rotated'] = np.empty(self.output_shape, dtype=np.uint8)
+        if self.selected_filter in ('blur', 'sharpen', 'edge_detect'):
+            buffers['filtered'] = np.empty(self.output_shape, dtype=np.uint8)
+        return buffers
+
+    def __call__(self, frame, buffers):
+        if self.grayscale:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=buffers['gray'])
+            if self.gray_lut is not None:
+                cv2.LUT(gray, self.gray_lut, dst=gray)
+            cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR, dst=frame)
+        elif self.invert_lut is not None:
+            cv2.LUT(frame, self.invert_lut, dst=frame)
+        if self.luma_lut is not None:
+            ycrcb = cv2.cvtColor(frame, cv2.COLOR_BGR2YCrCb, dst=buffers['ycrcb'])
+            cv2.LUT(ycrcb, self.luma_lut, dst=ycrcb)
+            cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2BGR, dst=frame)
+        if self.flip_code is not None:
+            cv2.flip(frame, self.flip_code, dst=frame)
+        elif self.rotate_code is not None:
+            frame = cv2.rotate(frame, self.rotate_code, dst=buffers['rotated'])
+        return self.apply_filter(frame, buffers)
+
+    def apply_filter(self, frame, buffers):
+        """Apply the selected OpenCV filter to a BGR frame of the output size"""
+        if self.selected_filter == 'blur':
+            return cv2.sepFilter2D(frame, -1, BLUR_KERNEL, BLUR_KERNEL, dst=buffers['filtered'])
+        elif self.selected_filter == 'sharpen':
+            return cv2.filter2D(frame, -1, SHARPEN_KERNEL, dst=buffers['filtered'])
+        elif self.selected_filter == 'edge_detect':
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=buffers['gray'])
+            edges = cv2.Canny(gray, *CANNY_THRESHOLDS, edges=buffers['edges'])
+            return cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR, dst=buffers['filtered'])
+        return frame
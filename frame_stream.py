@@ -0,0 +1,270 @@
+"""Managed FFmpeg processes and the pipe-based frame stage
+
+Every render runs FFmpeg as a child process that is polled rather than
+waited on, so progress can be read from its -progress stream and a
+cancelled job kills it at once. The frame stage chains an FFmpeg decoder,
+NumPy frames and an FFmpeg encoder: raw BGR frames travel over pipes
+between the two FFmpeg processes and the OpenCV loop, so no intermediate
+video file is written.
+"""
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import ffmpeg
+import numpy as np
+
+from offload import run_blocking
+from pipeline import FASTSTART, OUTPUT_PIX_FMT
+
+PROGRESS_POLL_INTERVAL = 0.25  # seconds between cancel and progress checks of run_ffmpeg
+
+
+def read_frame(stream, frame):
+    """Fill frame with the next raw frame from stream; None at end of stream"""
+    view = memoryview(frame).cast('B')
+    filled = 0
+    size = len(view)
+    while filled < size:
+        count = stream.readinto(view[filled:])
+        if not count:
+            return None
+        filled += count
+    return frame
+
+
+def _drain(stream, chunks):
+    """Collect a process's stderr so a full pipe never blocks it"""
+    for chunk in iter(lambda: stream.read(4096), b''):
+        chunks.append(chunk)
+
+
+def _read_progress(stream, progress):
+    """Keep progress updated with the last complete block of FFmpeg's -progress output"""
+    block = {}
+    for line in iter(stream.readline, b''):
+        key, _, value = line.decode('utf8', 'replace').strip().partition('=')
+        block[key] = value
+        if key == 'progress':  # ends each block
+            progress.update(block)
+            block = {}
+    stream.close()
+
+
+class FFmpegProcess:
+    """An FFmpeg child process with its stderr collected in the background
+
+    With progress=True, FFmpeg also writes -progress key=value blocks to a
+    pipe of their own (stdout stays free for frames), and the latest block
+    is available as .progress. read_stdout(stream), if given, consumes
+    stdout on a thread of its own until FFmpeg closes it.
+    """
+
+    def __init__(self, stream_spec, progress=False, read_stdout=None, **popen_kwargs):
+        self.cmd = ffmpeg.compile(stream_spec, overwrite_output=True)
+        self.progress = {}
+        progress_fds = None
+        if progress:
+            progress_fds = os.pipe()
+            self.cmd[1:1] = ['-progress', f'pipe:{progress_fds[1]}', '-nostats']
+            popen_kwargs['pass_fds'] = (progress_fds[1],)
+        if read_stdout:
+            popen_kwargs['stdout'] = subprocess.PIPE
+        self.process = subprocess.Popen(self.cmd, stderr=subprocess.PIPE, **popen_kwargs)
+        self._stderr_chunks = []
+        self._threads = [threading.Thread(target=_drain, args=(self.process.stderr, self._stderr_chunks))]
+        if read_stdout:
+            self._threads.append(threading.Thread(target=read_stdout, args=(self.process.stdout,)))
+        if progress_fds:
+            os.close(progress_fds[1])  # the child holds the write end now
+            self._threads.append(threading.Thread(target=_read_progress,
+                                                  args=(os.fdopen(progress_fds[0], 'rb'), self.progress)))
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    @property
+    def stderr(self):
+        """Everything the process has written to stderr so far"""
+        return b''.join(self._stderr_chunks)
+
+    def out_seconds(self):
+        """Output timestamp FFmpeg last reported via -progress, 0.0 before the first report"""
+        try:
+            return max(int(self.progress.get('out_time_us', '')) / 1e6, 0.0)
+        except ValueError:
+            return 0.0  # absent, or N/A before the first frame
+
+    def kill(self):
+        """Stop the process immediately (used on cancellation and cleanup)"""
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        for thread in self._threads:
+            thread.join()
+
+    def wait(self):
+        """Wait for the process and raise ffmpeg.Error if it failed"""
+        retcode = self.process.wait()
+        for thread in self._threads:
+            thread.join()
+        if retcode:
+            raise ffmpeg.Error(self.cmd[0], None, self.stderr)
+
+
+def run_ffmpeg(stream_spec, should_cancel, report_progress=None, expected_seconds=0.0,
+               message="Processing with FFmpeg", read_stdout=None):
+    """Run an FFmpeg command as a managed process
+
+    Progress is reported as (fraction, message) from the output timestamp
+    against expected_seconds (the output's duration), with FFmpeg's frame
+    count and speed and an ETA from the time spent so far. read_stdout
+    consumes an output written to pipe:, see FFmpegProcess. Returns False if
+    should_cancel was set, after killing FFmpeg; True on success. Raises
+    ffmpeg.Error on failure.
+    """
+    stdout = None if read_stdout else subprocess.DEVNULL
+    process = FFmpegProcess(stream_spec, progress=True, read_stdout=read_stdout,
+                            stdin=subprocess.DEVNULL, stdout=stdout)
+    started = time.monotonic()
+    fraction = 0.0
+    try:
+        while process.process.poll() is None:
+            if should_cancel.wait(PROGRESS_POLL_INTERVAL):
+                return False
+            position = process.out_seconds()
+            if report_progress and expected_seconds > 0 and position > 0:
+                # With several outputs the reported timestamp can step back; progress doesn't
+                fraction = max(fraction, min(position / expected_seconds, 1.0))
+                eta = (time.monotonic() - started) * (1 - fraction) / fraction
+                report_progress(fraction, f"{message}: {fraction * 100:.0f}% (frame {process.progress.get('frame', '?')}, "
+                                          f"{process.progress.get('speed', '?').strip()}), ETA {eta:.0f}s")
+        process.wait()
+    finally:
+        process.kill()
+    return True
+
+
+class FrameDecoder(FFmpegProcess):
+    """Decode a video to raw BGR frames read into one reused buffer"""
+
+    def __init__(self, input_path, width, height, video_filters=None):
+        output_options = {'format': 'rawvideo', 'pix_fmt': 'bgr24'}
+        if video_filters:
+            output_options['vf'] = ','.join(video_filters)
+        stream_spec = ffmpeg.input(input_path)['v:0'].output('pipe:', **output_options)
+        super().__init__(stream_spec, stdout=subprocess.PIPE)
+        self.frame = np.empty((height, width, 3), dtype=np.uint8)
+
+    def read(self, out=None):
+        """Read the next frame into `out` (default: the shared buffer); None at end of stream
+
+        The returned array is overwritten by the next read into the same buffer.
+        """
+        return read_frame(self.process.stdout, self.frame if out is None else out)
+
+    def kill(self):
+        self.process.stdout.close()
+        super().kill()
+
+    def wait(self):
+        self.process.stdout.close()
+        super().wait()
+
+
+class FrameEncoder(FFmpegProcess):
+    """Encode raw BGR frames from stdin to H.264, muxing audio from the source"""
+
+    def __init__(self, output_path, width, height, fps, audio_source=None,
+                 video_filters=None, audio_filters=None, encoder_options=None):
+        streams = [ffmpeg.input('pipe:', format='rawvideo', pix_fmt='bgr24',
+                                s=f'{width}x{height}', r=fps)]
+        if audio_source:
+            streams.append(ffmpeg.input(audio_source)['a?'])
+
+        output_options = {
+            'vf': ','.join(list(video_filters or []) + [f'format={OUTPUT_PIX_FMT}']),
+            'vcodec': 'libx264',
+            **(encoder_options or {}),
+            'movflags': FASTSTART,
+        }
+        if audio_source:
+            output_options['acodec'] = 'aac'
+            output_options['strict'] = 'experimental'
+            if audio_filters:
+                output_options['af'] = ','.join(audio_filters)
+
+        stream_spec = ffmpeg.output(*streams, output_path, **output_options)
+        super().__init__(stream_spec, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        """Send one BGR frame to the encoder"""
+        self.process.stdin.write(memoryview(frame).cast('B'))
+
+    def kill(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        super().kill()
+
+    def wait(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        super().wait()
+
+
+def run_frame_stage(decoder, encoder, frame_op, should_cancel, on_frame=None, workers=1):
+    """Pump frames from decoder through frame_op into encoder, keeping their order
+
+    frame_op is a frame_ops.FrameOp, or anything with its interface:
+    op(frame, buffers) with buffers from op.new_buffers(). Filtering runs on
+    a pool of `workers` threads (the OpenCV calls release the GIL); under
+    eventlet those are green threads, so each hands its frame to a real OS
+    thread (offload.run_blocking). At most two frames per worker are in
+    flight, each in a slot of a decode buffer and frame_op's buffers, all
+    allocated up front and reused, so the loop allocates no frames. Pending
+    results are kept in submission order, so the oldest one is always the
+    next to be written. on_frame(count, frame) is called after each write,
+    before the frame's slot is reused. Returns the number of frames written,
+    or None if the job was cancelled.
+    """
+    workers = max(1, workers)
+    depth = workers * 2
+    free_slots = deque((np.empty_like(decoder.frame), frame_op.new_buffers()) for _ in range(depth))
+    pending = deque()  # (future, slot) in decode order
+    written = 0
+    end_of_stream = False
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='frame-filter') as pool:
+        while not end_of_stream or pending:
+            if should_cancel.is_set():
+                for future, _ in pending:
+                    future.cancel()
+                return None
+
+            # Keep the window full before writing anything out
+            if not end_of_stream and free_slots:
+                slot = free_slots.popleft()
+                frame = decoder.read(slot[0])
+                if frame is None:
+                    end_of_stream = True
+                    free_slots.append(slot)
+                else:
+                    pending.append((pool.submit(run_blocking, frame_op, frame, slot[1]), slot))
+                continue
+
+            future, slot = pending.popleft()
+            frame = future.result()
+            encoder.write(frame)
+            written += 1
+            if on_frame:
+                on_frame(written, frame)
+            free_slots.append(slot)
+
+    return written
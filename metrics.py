@@ -0,0 +1,103 @@
+"""Per-stage job timings and their Prometheus exposition
+
+Each step of a job (saving the upload, the render, HLS packaging) runs
+inside a stage span that measures wall time, CPU time, bytes in and out and
+frames per second. Spans are stored on the job and aggregated per stage by
+StageMetrics, which /metrics renders in the Prometheus text format.
+"""
+import contextlib
+import resource
+import threading
+import time
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _children_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+@contextlib.contextmanager
+def stage_span(stage, on_finish):
+    """Measure the enclosed block as one stage and pass the span to on_finish
+
+    The block may fill in bytes_read, bytes_written and frames on the
+    yielded span. CPU time is this thread's plus that of child processes
+    (FFmpeg) reaped meanwhile; with several jobs running at once, children
+    of another job that exit during the span are counted too. The span is
+    reported even if the block raises, so failed stages show up as well.
+    """
+    span = {'stage': stage, 'bytes_read': 0, 'bytes_written': 0, 'frames': 0}
+    started = time.time()
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time() + _children_cpu_seconds()
+    try:
+        yield span
+    finally:
+        wall = time.perf_counter() - wall_start
+        span.update(
+            started_at=started,
+            wall_seconds=round(wall, 4),
+            cpu_seconds=round(time.thread_time() + _children_cpu_seconds() - cpu_start, 4),
+            fps=round(span['frames'] / wall, 2) if span['frames'] and wall > 0 else 0.0
+        )
+        on_finish(span)
+
+
+class StageMetrics:
+    """Per-stage counters and a wall time histogram, fed with finished spans"""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._stages = {}  # stage -> totals and bucket counts
+
+    def observe(self, span):
+        with self._lock:
+            totals = self._stages.setdefault(span['stage'], {
+                'count': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                'bytes_read': 0, 'bytes_written': 0, 'frames': 0,
+                'buckets': [0] * len(self.buckets),
+            })
+            totals['count'] += 1
+            for key in ('wall_seconds', 'cpu_seconds', 'bytes_read', 'bytes_written', 'frames'):
+                totals[key] += span.get(key) or 0
+            for index, bound in enumerate(self.buckets):
+                if span['wall_seconds'] <= bound:
+                    totals['buckets'][index] += 1
+
+    def render(self, gauges=()):
+        """Prometheus text exposition of the stage metrics plus (name, help, value) gauges"""
+        with self._lock:
+            stages = {stage: dict(totals, buckets=list(totals['buckets'])) for stage, totals in self._stages.items()}
+
+        lines = [
+            '# HELP video_stage_seconds Wall time of job stages',
+            '# TYPE video_stage_seconds histogram',
+        ]
+        for stage, totals in sorted(stages.items()):
+            for bound, count in zip(self.buckets, totals['buckets']):
+                lines.append(f'video_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'video_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {totals["count"]}')
+            lines.append(f'video_stage_seconds_sum{{stage="{stage}"}} {totals["wall_seconds"]:.4f}')
+            lines.append(f'video_stage_seconds_count{{stage="{stage}"}} {totals["count"]}')
+
+        counters = [
+            ('video_stage_cpu_seconds_total', 'cpu_seconds', 'CPU time of job stages, including FFmpeg child processes'),
+            ('video_stage_bytes_read_total', 'bytes_read', 'Bytes read by job stages'),
+            ('video_stage_bytes_written_total', 'bytes_written', 'Bytes written by job stages'),
+            ('video_stage_frames_total', 'frames', 'Frames processed by job stages'),
+        ]
+        for name, key, help_text in counters:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for stage, totals in sorted(stages.items()):
+                lines.append(f'{name}{{stage="{stage}"}} {round(totals[key], 4)}')
+
+        for name, help_text, value in gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
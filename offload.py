@@ -0,0 +1,30 @@
+"""Keep blocking calls off the eventlet hub
+
+Production runs a single gunicorn eventlet worker, which monkey-patches
+threading, subprocess and sockets: job threads are green threads sharing one
+OS thread with HTTP and Socket.IO. FFmpeg pipes, Redis and event waits yield
+to the hub there, but OpenCV calls don't, and frame workers run one at a
+time. run_blocking hands such calls to eventlet's pool of real OS threads
+(tpool) when the process is monkey-patched, and calls them directly
+otherwise (development server, Redis workers, segment processes).
+"""
+try:
+    from eventlet import patcher, tpool
+except ImportError:  # eventlet is only needed by the production server
+    patcher = tpool = None
+
+
+def green_threads():
+    """True when threading is monkey-patched by eventlet"""
+    return patcher is not None and patcher.is_monkey_patched('thread')
+
+
+def run_blocking(func, *args, **kwargs):
+    """Call func on a real OS thread under eventlet, else in the calling thread
+
+    func must not touch green sockets or locks (Redis, Socket.IO, job
+    events); OpenCV and NumPy calls on arrays it owns are fine.
+    """
+    if green_threads():
+        return tpool.execute(func, *args, **kwargs)
+    return func(*args, **kwargs)
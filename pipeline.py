@@ -0,0 +1,323 @@
+"""Processing planner: turns a job's options into a single FFmpeg filter graph"""
+import os
+from fractions import Fraction
+
+import ffmpeg
+
+# FFmpeg filters for each transformation
+TRANSFORM_FILTERS = {
+    'grayscale': ['format=gray'],
+    'invert': ['negate'],
+    'hflip': ['hflip'],
+    'vflip': ['vflip'],
+    # Right angles are exact pixel remaps with the output size swapped as needed
+    'rotate90': ['transpose=clock'],
+    'rotate180': ['hflip', 'vflip'],
+    'rotate270': ['transpose=cclock'],
+}
+
+# Clockwise degrees of each rotation, for the metadata-only path
+ROTATION_DEGREES = {'rotate90': 90, 'rotate180': 180, 'rotate270': 270}
+
+# Factors this close to 1 change no 8-bit level (or barely any timing) and are treated as 1
+NEUTRAL_TOLERANCE = 0.002
+
+# Containers whose muxer writes a display matrix
+DISPLAY_MATRIX_EXTENSIONS = ('.mp4', '.mov')
+
+# FFmpeg equivalents of the OpenCV frame filters
+SHARPEN_MATRIX = '-1 -1 -1 -1 9 -1 -1 -1 -1'
+FRAME_FILTERS = {
+    # cv2.GaussianBlur(frame, (15, 15), 0) derives sigma = 0.3 * ((15 - 1) * 0.5 - 1) + 0.8
+    'blur': ['gblur=sigma=2.6'],
+    # Same 3x3 kernel as the OpenCV sharpen path, applied to every plane
+    'sharpen': [f'convolution=0m={SHARPEN_MATRIX}:1m={SHARPEN_MATRIX}:2m={SHARPEN_MATRIX}'],
+    # cv2.Canny(gray, 100, 200) on 8-bit luma
+    'edge_detect': ['format=gray', 'edgedetect=low=100/255:high=200/255'],
+}
+# Extra CPU time per pixel of each frame filter, relative to a decode
+FRAME_FILTER_COST = {'blur': 1.0, 'sharpen': 0.5, 'edge_detect': 0.5}
+# A stream copy only moves packets
+STREAM_COPY_COST = 0.01
+
+# Browsers only play 4:2:0 H.264 reliably
+OUTPUT_PIX_FMT = 'yuv420p'
+
+# libx264 settings per encoder profile; the preset is the main speed/size trade-off on CPU-only nodes.
+# max_bits_per_pixel caps the bitrate in proportion to the output's pixel rate (width x height x fps);
+# encode_cost is the preset's CPU time per pixel relative to a decode, for estimate_cost.
+# tune: fast outputs (mostly previews) decode cheaply in the browser, archive keeps film grain detail.
+# threads is the profile's x264 thread count (0 = automatic) when ENCODER_THREADS doesn't set one: previews
+# run next to full jobs, so they take two cores rather than all of them.
+ENCODER_PROFILES = {
+    'fast': {'preset': 'veryfast', 'crf': 26, 'tune': 'fastdecode', 'threads': 2, 'max_bits_per_pixel': 0.08,
+             'encode_cost': 2.0},
+    'balanced': {'preset': 'medium', 'crf': 23, 'tune': None, 'threads': 0, 'max_bits_per_pixel': 0.1,
+                 'encode_cost': 5.0},
+    'archive': {'preset': 'slow', 'crf': 18, 'tune': 'film', 'threads': 0, 'max_bits_per_pixel': 0.2,
+                'encode_cost': 10.0},
+}
+DEFAULT_ENCODER_PROFILE = 'balanced'
+
+# Put the moov atom first so playback can start before the whole file is fetched
+FASTSTART = '+faststart'
+
+# HLS packages live next to their MP4 in hls_<output stem>/
+HLS_DIR_PREFIX = 'hls_'
+HLS_PLAYLIST = 'index.m3u8'
+# Poster and scrub thumbnails likewise in thumbs_<output stem>/ (see thumbnails.py)
+THUMBNAILS_DIR_PREFIX = 'thumbs_'
+
+
+def parse_float(value, default=1.0):
+    """Parse a form value as float, falling back to a default"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_factor(options, key):
+    """Parse a brightness/contrast/speed factor; invalid values and no-op factors become 1.0"""
+    value = parse_float(options.get(key, '1.0'))
+    if value <= 0 or abs(value - 1.0) < NEUTRAL_TOLERANCE:
+        return 1.0
+    return value
+
+
+def eq_filters(options):
+    """Build the eq filter for brightness/contrast, if any adjustment is requested"""
+    eq_params = []
+    b_val = parse_factor(options, 'brightness')
+    if b_val != 1.0:
+        eq_params.append(f'brightness={b_val - 1.0:g}')
+    c_val = parse_factor(options, 'contrast')
+    if c_val != 1.0:
+        eq_params.append(f'contrast={c_val:g}')
+    if not eq_params:
+        return []
+    return ['eq=' + ':'.join(eq_params)]
+
+
+def transform_filters(options):
+    """Transformation and color adjustment filters, in the order they are applied"""
+    filters = list(TRANSFORM_FILTERS.get(options.get('transformation', 'none'), []))
+    filters += eq_filters(options)
+    return filters
+
+
+def frame_filters(options):
+    """FFmpeg filters replacing the OpenCV blur/sharpen/edge_detect step"""
+    return list(FRAME_FILTERS.get(options.get('filter', 'none'), []))
+
+
+def speed_video_filters(speed, source_fps=None):
+    """Retime video frames for a playback speed
+
+    With the source frame rate known, the output keeps it: a speedup drops
+    frames and a slowdown repeats them, instead of encoding at whatever rate
+    FFmpeg guesses for the retimed stream.
+    """
+    if speed == 1.0:
+        return []
+    filters = [f'setpts={1 / speed:g}*PTS']
+    if source_fps:
+        filters.append(f'fps={Fraction(source_fps).limit_denominator(1001)}')
+    return filters
+
+
+def speed_audio_filters(speed):
+    """Chain atempo filters so every stage stays within its 0.5-2.0 range"""
+    if speed == 1.0:
+        return []
+    filters = []
+    remaining = speed
+    while remaining > 2.0:
+        filters.append('atempo=2.0')
+        remaining /= 2.0
+    while remaining < 0.5:
+        filters.append('atempo=0.5')
+        remaining /= 0.5
+    filters.append(f'atempo={remaining:g}')
+    return filters
+
+
+def supports_display_matrix(output_path):
+    return output_path.lower().endswith(DISPLAY_MATRIX_EXTENSIONS)
+
+
+def encoder_profile(options):
+    """Name of the job's encoder profile, falling back to the default for unknown names"""
+    profile = options.get('profile') or DEFAULT_ENCODER_PROFILE
+    return profile if profile in ENCODER_PROFILES else DEFAULT_ENCODER_PROFILE
+
+
+def encoder_options(profile, pixel_rate=None, threads=0):
+    """libx264 output options for a profile
+
+    With the output's pixel rate known, the bitrate is capped through the
+    VBV (maxrate/bufsize) in proportion to it, so CRF can't overshoot at high
+    resolutions while small outputs aren't held to a large-frame bitrate.
+    threads=0 uses the profile's thread count, which may in turn let x264
+    choose.
+    """
+    settings = ENCODER_PROFILES[profile]
+    options = {'vcodec': 'libx264', 'preset': settings['preset'], 'crf': settings['crf']}
+    if settings['tune']:
+        options['tune'] = settings['tune']
+    if pixel_rate:
+        max_kbps = max(1, int(pixel_rate * settings['max_bits_per_pixel'] / 1000))
+        options['maxrate'] = f'{max_kbps}k'
+        options['bufsize'] = f'{2 * max_kbps}k'
+    threads = threads or settings['threads']
+    if threads:
+        options['threads'] = threads
+    return options
+
+
+def plan_processing(options, metadata_rotation=False, source_info=None, encoder_threads=0):
+    """Plan a job as one decode and one encode
+
+    Returns a dict with the video filter chain, the audio filter chain and
+    whether the job can be served by a plain stream copy. Options that
+    change nothing plan no filters, so a job made only of them is a copy.
+    With metadata_rotation, a job that only rotates is planned as a stream
+    copy that sets the display matrix instead (display_rotation, clockwise
+    degrees). source_info (from probe.probe_input or render.read_stream_info)
+    keeps the frame rate through speed changes and scales the encoder's
+    bitrate cap. A probe that found no audio stream plans no audio filters.
+    picture_filters and retime_filters split video_filters for outputs that
+    sample frames before filtering them (build_output's sample_rate).
+    """
+    source_fps = source_info['fps'] if source_info else None
+    speed = parse_factor(options, 'speed')
+    picture_filters = transform_filters(options) + frame_filters(options)
+    retime_filters = speed_video_filters(speed, source_fps)
+    video_filters = picture_filters + retime_filters
+    audio_filters = speed_audio_filters(speed)
+    if source_info and source_info.get('has_audio') is False:
+        audio_filters = []
+
+    display_rotation = None
+    rotation = ROTATION_DEGREES.get(options.get('transformation', 'none'))
+    if metadata_rotation and rotation and not eq_filters(options) and not frame_filters(options) and speed == 1.0:
+        display_rotation = rotation
+        video_filters = []
+
+    return {
+        'speed': speed,
+        'video_filters': video_filters,
+        'picture_filters': picture_filters,
+        'retime_filters': retime_filters,
+        'audio_filters': audio_filters,
+        'display_rotation': display_rotation,
+        'stream_copy': not video_filters and not audio_filters,
+        # Rotations keep the pixel count and the fps filter keeps the frame rate
+        'encoder': encoder_options(
+            encoder_profile(options),
+            source_info['width'] * source_info['height'] * source_fps if source_info else None,
+            encoder_threads
+        ),
+    }
+
+
+def estimate_cost(options, source_info):
+    """Estimated processing cost of a job, in megapixels of decode-equivalent work
+
+    Decoding every source pixel counts 1 per pixel, frame filters and the
+    encoder preset add their relative cost per pixel they touch. Only
+    comparisons between jobs are meaningful; the scheduler runs cheaper
+    jobs first within a priority.
+    """
+    plan = plan_processing(options, source_info=source_info)
+    pixels = source_info['width'] * source_info['height']
+    decoded = pixels * source_info['total_frames']
+    if plan['stream_copy']:
+        return round(decoded * STREAM_COPY_COST / 1e6, 3)
+    # The fps filter keeps the frame rate, so the output has duration / speed worth of frames
+    encoded = pixels * source_info['total_frames'] / plan['speed']
+    filtered = decoded * FRAME_FILTER_COST.get(options.get('filter', 'none'), 0.0)
+    encode = encoded * ENCODER_PROFILES[encoder_profile(options)]['encode_cost']
+    return round((decoded + filtered + encode) / 1e6, 3)
+
+
+def build_output(input_path, output_path, plan, sample_rate=None):
+    """Build the ffmpeg-python output node that executes a plan
+
+    The audio stream is mapped optionally, so inputs without audio need no
+    separate code path. With sample_rate, the same decode also feeds raw BGR
+    frames of the rendered picture, sample_rate per second of output, to
+    stdout (for thumbnails.ThumbnailSheet). That output drops frames before
+    running the job's filters, so it adds next to nothing to the render.
+    """
+    input_options = {}
+    if plan['display_rotation'] is not None:
+        # FFmpeg's display_rotation is counter-clockwise
+        input_options['display_rotation'] = -plan['display_rotation']
+    source = ffmpeg.input(input_path, **input_options)
+    output = _output_node(source, output_path, plan)
+    if not sample_rate or plan['stream_copy']:
+        return output
+    # Per-frame filters commute with retiming, so the samples are taken first and only they are filtered
+    sample_filters = plan['retime_filters'] + [f'fps={sample_rate:.6f}'] + plan['picture_filters'] + ['format=bgr24']
+    samples = ffmpeg.output(source['v:0'], 'pipe:', vf=','.join(sample_filters), format='rawvideo')
+    return ffmpeg.merge_outputs(output, samples)
+
+
+def build_batch_output(input_path, outputs):
+    """Build one FFmpeg command rendering several plans of the same input
+
+    outputs is a list of (output_path, plan). FFmpeg decodes each input
+    stream once and feeds every output mapped from it through that output's
+    own filter chain, so the decode is shared by all plans.
+    """
+    source = ffmpeg.input(input_path)
+    return ffmpeg.merge_outputs(*[_output_node(source, output_path, plan) for output_path, plan in outputs])
+
+
+def _output_node(source, output_path, plan):
+    streams = [source['v:0'], source['a?']]
+
+    if plan['stream_copy']:
+        return ffmpeg.output(*streams, output_path, vcodec='copy', acodec='copy', movflags=FASTSTART)
+
+    output_options = {
+        'vf': ','.join(plan['video_filters'] + [f'format={OUTPUT_PIX_FMT}']),
+        **plan['encoder'],
+        'acodec': 'aac',
+        'strict': 'experimental',
+        'movflags': FASTSTART,
+    }
+    if plan['audio_filters']:
+        output_options['af'] = ','.join(plan['audio_filters'])
+
+    return ffmpeg.output(*streams, output_path, **output_options)
+
+
+def hls_dir_name(output_filename):
+    """Directory holding the HLS package of a processed file"""
+    return HLS_DIR_PREFIX + output_filename.rsplit('.', 1)[0]
+
+
+def thumbnails_dir_name(output_filename):
+    """Directory holding the poster and thumbnail sprite of a processed file"""
+    return THUMBNAILS_DIR_PREFIX + output_filename.rsplit('.', 1)[0]
+
+
+def sidecar_dir_names(output_filename):
+    """Directories generated next to a processed file, removed along with it"""
+    return [hls_dir_name(output_filename), thumbnails_dir_name(output_filename)]
+
+
+def build_hls_output(input_path, output_dir, segment_seconds=4):
+    """Repackage a processed file as VOD HLS with fMP4 segments (no re-encode)"""
+    return ffmpeg.input(input_path).output(
+        os.path.join(output_dir, HLS_PLAYLIST),
+        c='copy',
+        format='hls',
+        hls_time=segment_seconds,
+        hls_playlist_type='vod',
+        hls_segment_type='fmp4',
+        hls_fmp4_init_filename='init.mp4',
+        hls_segment_filename=os.path.join(output_dir, 'seg_%05d.m4s'),
+    )
@@ -0,0 +1,169 @@
+"""Low-resolution previews of a job's options
+
+The first seconds of an upload are decoded once into a small proxy clip.
+Every preview then renders that proxy with the same pipeline as a full job,
+so trying other options costs a few seconds of 360p instead of a transcode.
+"""
+import contextlib
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+
+import ffmpeg
+
+import render
+from result_cache import make_cache_key, save_and_hash
+
+PROXY_PREFIX = 'proxy_'
+PREVIEW_PREFIX = 'preview_'
+SOURCE_ID_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+class PreviewBusyError(Exception):
+    """All preview slots are in use; the caller should retry shortly"""
+
+
+class PreviewSourceMissingError(Exception):
+    """The source was evicted (or never stored); the caller should upload it again"""
+
+
+def build_proxy(input_path, proxy_path, seconds, height):
+    """Cut the first seconds of a video and scale them down to at most height lines
+
+    The proxy is intra-only and tuned for fast decoding, since it is decoded
+    again for every preview.
+    """
+    info = render.read_stream_info(input_path)
+    video_filters = []
+    if info['height'] > height:
+        video_filters.append(f'scale=-2:{height}')
+    video_filters.append('format=yuv420p')
+
+    source = ffmpeg.input(input_path, t=seconds)
+    try:
+        ffmpeg.output(source['v:0'], source['a?'], proxy_path,
+                      vf=','.join(video_filters), vcodec='libx264', preset='ultrafast',
+                      tune='fastdecode', crf=18, g=1, acodec='aac')\
+              .run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
+    except ffmpeg.Error as e:
+        raise render.RenderError(f"Preview proxy error: {e.stderr.decode('utf8')}")
+
+
+class PreviewStore:
+    """Proxies of recent preview sources and the previews rendered from them
+
+    A source is identified by the SHA-256 of the uploaded bytes, so uploading
+    the same file again reuses its proxy. Sources beyond max_sources are
+    evicted least recently used first, together with their previews.
+    """
+
+    def __init__(self, directory, max_sources=8, seconds=5, height=360, max_concurrent=2):
+        self.directory = directory
+        self.max_sources = max_sources
+        self.seconds = seconds
+        self.height = height
+        self._sources = OrderedDict()  # source_id -> None, least recently used first
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Index proxies already on disk, oldest first"""
+        proxies = []
+        for filename in os.listdir(self.directory):
+            if filename.startswith(PROXY_PREFIX) and filename.endswith('.mp4'):
+                source_id = filename[len(PROXY_PREFIX):-len('.mp4')]
+                proxies.append((os.path.getmtime(os.path.join(self.directory, filename)), source_id))
+        for _, source_id in sorted(proxies):
+            self._sources[source_id] = None
+
+    def proxy_path(self, source_id):
+        return os.path.join(self.directory, f"{PROXY_PREFIX}{source_id}.mp4")
+
+    def has_source(self, source_id):
+        return bool(SOURCE_ID_PATTERN.fullmatch(source_id)) and os.path.exists(self.proxy_path(source_id))
+
+    def add_source(self, file_storage):
+        """Store an upload as a preview source and return its id"""
+        upload_path = os.path.join(self.directory, f"upload_{uuid.uuid4()}")
+        try:
+            source_id = save_and_hash(file_storage, upload_path)
+            if not os.path.exists(self.proxy_path(source_id)):
+                with self._busy():
+                    partial_path = os.path.join(self.directory, f"partial_{uuid.uuid4()}.mp4")
+                    try:
+                        build_proxy(upload_path, partial_path, self.seconds, self.height)
+                        os.replace(partial_path, self.proxy_path(source_id))
+                    finally:
+                        if os.path.exists(partial_path):
+                            os.remove(partial_path)
+        finally:
+            os.remove(upload_path)
+        self._touch(source_id)
+        return source_id
+
+    def render(self, source_id, options, engine='ffmpeg', **render_kwargs):
+        """Render a preview of options from a source's proxy and return its filename
+
+        Previews are cached per source and options, so asking again is free.
+        Raises PreviewSourceMissingError if the source was evicted meanwhile.
+        """
+        key = make_cache_key(source_id, options, engine)
+        filename = f"{PREVIEW_PREFIX}{source_id}_{key[:16]}.mp4"
+        path = os.path.join(self.directory, filename)
+        if not self._touch(source_id):
+            raise PreviewSourceMissingError(f"Preview source {source_id[:12]} not found")
+        if os.path.exists(path):
+            return filename
+
+        partial_path = os.path.join(self.directory, f"partial_{uuid.uuid4()}.mp4")
+        with self._busy():
+            try:
+                render.render_video(self.proxy_path(source_id), partial_path, options,
+                                    threading.Event(), **render_kwargs)
+                os.replace(partial_path, path)
+            finally:
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+        return filename
+
+    @contextlib.contextmanager
+    def _busy(self):
+        """Hold a preview slot, or raise PreviewBusyError if none is free"""
+        if not self._slots.acquire(blocking=False):
+            raise PreviewBusyError("Too many previews are rendering")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def _touch(self, source_id):
+        """Mark a source as just used and evict the least recently used ones; False if it is gone"""
+        with self._lock:
+            try:
+                os.utime(self.proxy_path(source_id))
+            except FileNotFoundError:
+                # Evicted by another request since the caller checked for it
+                self._sources.pop(source_id, None)
+                return False
+            self._sources[source_id] = None
+            self._sources.move_to_end(source_id)
+            evicted = list(self._sources)[:-self.max_sources] if len(self._sources) > self.max_sources else []
+            for old_id in evicted:
+                del self._sources[old_id]
+        for old_id in evicted:
+            self._remove_source(old_id)
+        return True
+
+    def _remove_source(self, source_id):
+        for filename in os.listdir(self.directory):
+            if filename == f"{PROXY_PREFIX}{source_id}.mp4" or filename.startswith(f"{PREVIEW_PREFIX}{source_id}_"):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    pass
+        print(f"🗑️ Evicted preview source {source_id[:12]}")
+
@@ -0,0 +1,104 @@
+"""Media probe: what an input contains, read once when it is uploaded
+
+One ffprobe call returns the streams and codecs, frame rate, duration and
+every video packet, from which the exact frame count (right for VFR files
+too) and the keyframe index are taken. The result is stored with the job's
+options, so later stages plan with it instead of opening the file again.
+Without ffprobe, OpenCV's estimates are used as before.
+"""
+from fractions import Fraction
+
+import ffmpeg
+
+import render
+
+# Packets give the exact frame count and the keyframe index in the same call
+PROBE_ENTRIES = 'packet=stream_index,pts_time,flags'
+
+
+class ProbeError(Exception):
+    """The input could not be probed; the message is suitable for the job's error field"""
+
+
+def parse_rate(rate):
+    """Frame rate from ffprobe's 'num/den' form, or 0.0 if unknown"""
+    try:
+        value = Fraction(rate)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return 0.0
+    return float(value)
+
+
+def probe_media(input_path):
+    """Probe a video file with ffprobe
+
+    Returns the keys of render.read_stream_info (fps, width, height,
+    total_frames, duration, rotation) plus codecs, audio details, the
+    keyframe timestamps and whether the frame rate is variable. Raises
+    ProbeError if ffprobe fails or the file has no video stream.
+    """
+    try:
+        data = ffmpeg.probe(input_path, show_entries=PROBE_ENTRIES)
+    except ffmpeg.Error as e:
+        raise ProbeError(f"Could not read video file: {e.stderr.decode('utf8', 'replace').strip()}")
+
+    streams = data.get('streams', [])
+    video = next((stream for stream in streams if stream.get('codec_type') == 'video'), None)
+    if video is None:
+        raise ProbeError("The file has no video stream")
+    audio = next((stream for stream in streams if stream.get('codec_type') == 'audio'), None)
+
+    video_packets = [packet for packet in data.get('packets', []) if packet.get('stream_index') == video['index']]
+    keyframes = sorted(float(packet['pts_time']) for packet in video_packets
+                       if 'K' in packet.get('flags', '') and packet.get('pts_time') not in (None, 'N/A'))
+
+    fps = parse_rate(video.get('avg_frame_rate')) or parse_rate(video.get('r_frame_rate')) or 25.0
+    duration = float(data.get('format', {}).get('duration') or video.get('duration') or 0.0)
+    total_frames = len(video_packets) or int(video.get('nb_frames') or 0) or int(duration * fps)
+
+    # The display matrix holds counter-clockwise degrees; older files carry a clockwise rotate tag
+    rotation = 0
+    for side_data in video.get('side_data_list', []):
+        if 'rotation' in side_data:
+            rotation = int(-float(side_data['rotation'])) % 360
+    if not rotation and video.get('tags', {}).get('rotate'):
+        rotation = int(video['tags']['rotate']) % 360
+    width, height = int(video.get('width', 0)), int(video.get('height', 0))
+    if rotation in (90, 270):
+        width, height = height, width  # as displayed, like read_stream_info
+
+    return {
+        'fps': fps,
+        'width': width,
+        'height': height,
+        'total_frames': total_frames,
+        'duration': duration,
+        'rotation': rotation,
+        'variable_frame_rate': video.get('avg_frame_rate') != video.get('r_frame_rate'),
+        'video_codec': video.get('codec_name'),
+        'pix_fmt': video.get('pix_fmt'),
+        'has_audio': audio is not None,
+        'audio_codec': audio.get('codec_name') if audio else None,
+        'audio_channels': int(audio.get('channels', 0)) if audio else 0,
+        'sample_rate': int(audio.get('sample_rate', 0)) if audio else 0,
+        'keyframes': keyframes,
+        'size': int(data.get('format', {}).get('size') or 0),
+        'probed_with': 'ffprobe',
+    }
+
+
+def probe_input(input_path):
+    """Probe with ffprobe, or with OpenCV where ffprobe isn't installed
+
+    The OpenCV fallback has no codec, audio or keyframe details (has_audio
+    and keyframes are None). Raises ProbeError if the file can't be read.
+    """
+    try:
+        return probe_media(input_path)
+    except FileNotFoundError:
+        pass  # no ffprobe binary
+    try:
+        info = render.read_stream_info(input_path)
+    except render.RenderError as e:
+        raise ProbeError(str(e))
+    return dict(info, has_audio=None, keyframes=None, probed_with='opencv')
@@ -0,0 +1,87 @@
+"""Throttled, coalesced job progress publishing
+
+Frame loops report progress far more often than anyone needs to see it.
+The publisher forwards an update at once when the status changes, the
+progress moved by at least min_delta, or min_interval has passed since the
+job's last publish. Anything else is held back, and only the newest held
+update per job is published once its interval is up.
+"""
+import threading
+import time
+
+
+class ProgressPublisher:
+    """Rate-limit progress updates per job
+
+    write_fields(job_id, fields) persists only the fields that changed;
+    emit(job_id, payload) delivers the update to the job's subscribers.
+    """
+
+    def __init__(self, write_fields, emit, min_interval=0.5, min_delta=5):
+        self.write_fields = write_fields
+        self.emit = emit
+        self.min_interval = min_interval
+        self.min_delta = min_delta
+        self._lock = threading.Lock()
+        self._published = {}  # job_id -> (time, {'progress', 'message', 'status'})
+        self._pending = {}  # job_id -> newest held-back update
+        self._flusher = None
+
+    def publish(self, job_id, progress, message, status=None):
+        update = {'progress': progress, 'message': message, 'status': status}
+        with self._lock:
+            last_time, last = self._published.get(job_id, (0.0, {}))
+            due = (
+                (status and status != last.get('status')) or
+                abs(progress - last.get('progress', 0)) >= self.min_delta or
+                time.monotonic() - last_time >= self.min_interval
+            )
+            if due:
+                self._pending.pop(job_id, None)
+                self._send(job_id, update)
+            else:
+                self._pending[job_id] = update
+                self._ensure_flusher()
+
+    def discard(self, job_id):
+        """Drop held-back updates and state for a job that has finished"""
+        with self._lock:
+            self._pending.pop(job_id, None)
+            self._published.pop(job_id, None)
+
+    def _send(self, job_id, update):
+        # Called with the lock held, so a job can't be discarded halfway through a send
+        _, last = self._published.get(job_id, (0.0, {}))
+        fields = {key: value for key, value in update.items()
+                  if value is not None and last.get(key) != value}
+        merged = dict(last)
+        merged.update(fields)
+        self._published[job_id] = (time.monotonic(), merged)
+        if fields:
+            self.write_fields(job_id, fields)
+        self.emit(job_id, {
+            'job_id': job_id,
+            'progress': update['progress'],
+            'message': update['message'],
+            'status': update['status'] or 'processing'
+        })
+
+    def _ensure_flusher(self):
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(target=self._flush_loop, name='progress-flusher')
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def _flush_loop(self):
+        """Publish held-back updates whose interval has passed"""
+        while True:
+            time.sleep(self.min_interval / 2)
+            now = time.monotonic()
+            with self._lock:
+                due = [
+                    (job_id, update) for job_id, update in self._pending.items()
+                    if now - self._published.get(job_id, (0.0, {}))[0] >= self.min_interval
+                ]
+                for job_id, update in due:
+                    del self._pending[job_id]
+                    self._send(job_id, update)
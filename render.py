@@ -0,0 +1,255 @@
+"""Render one video file with a job's options
+
+Shared by whole-file jobs in the web process and by segment workers, so it
+must not depend on the Flask app.
+"""
+import subprocess
+
+import cv2
+import ffmpeg
+import numpy as np
+
+import frame_ops
+import pipeline
+from offload import run_blocking
+from frame_stream import FFmpegProcess, FrameDecoder, FrameEncoder, read_frame, run_ffmpeg, run_frame_stage
+from frame_stream import PROGRESS_POLL_INTERVAL
+from thumbnails import ThumbnailSheet
+from uploads import feed_growing_file
+
+
+class RenderError(Exception):
+    """Rendering failed; the message is suitable for the job's error field"""
+
+
+def _ignore_progress(fraction, message):
+    pass
+
+
+def read_stream_info(input_path):
+    """Read fps, frame size, frame count and duration of a video with OpenCV
+
+    Opening the container blocks in OpenCV, so under eventlet it runs on an
+    OS thread (offload.run_blocking).
+    """
+    return run_blocking(_read_stream_info, input_path)
+
+
+def _read_stream_info(input_path):
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise RenderError(f"Could not open video file: {input_path}")
+
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    rotation = int(cap.get(cv2.CAP_PROP_ORIENTATION_META)) % 360
+    cap.release()
+
+    if fps == 0:
+        fps = 25.0
+
+    return {
+        'fps': fps,
+        'width': width,
+        'height': height,
+        'total_frames': total_frames,
+        'duration': total_frames / fps if total_frames > 0 else 0.0,
+        'rotation': rotation,  # clockwise display rotation; width/height are as displayed
+    }
+
+
+def render_video(input_path, output_path, options, should_cancel, report_progress=None,
+                 opencv_frame_filters=False, frame_workers=1, growing_input_length=None,
+                 metadata_rotation=False, encoder_threads=0, source_info=None, thumbnails_dir=None,
+                 thumbnail_interval=2.0):
+    """Render input_path to output_path
+
+    Progress is reported as (fraction of this render, message). Returns False
+    if should_cancel was set, True on success; raises RenderError on failure.
+    With growing_input_length, input_path is an upload still being written
+    and is piped to FFmpeg as its bytes arrive (planned from the stream info
+    of the prefix received so far). With metadata_rotation, a
+    rotation-only job into MP4/MOV just rewrites the display matrix.
+    encoder_threads limits x264's threads (0 = automatic). source_info is
+    the upload's probe (probe.probe_input); without it the stream info is
+    read here. With thumbnails_dir, a poster and a thumbnail sprite sampled
+    every thumbnail_interval seconds are written there as by-products of
+    the decode (not for stream copies, which decode nothing).
+    """
+    report_progress = report_progress or _ignore_progress
+    selected_filter = options.get('filter', 'none')
+
+    if growing_input_length:
+        # Only a prefix has arrived, but its headers give the frame rate speed changes must keep
+        try:
+            info = read_stream_info(input_path)
+        except RenderError:
+            info = None  # FFmpeg picks the retimed stream's rate
+        plan = pipeline.plan_processing(options, source_info=info, encoder_threads=encoder_threads)
+        return _render_growing_input(input_path, growing_input_length, output_path, plan,
+                                     should_cancel, report_progress)
+
+    info = source_info or read_stream_info(input_path)
+    metadata_rotation = metadata_rotation and pipeline.supports_display_matrix(output_path)
+    plan = pipeline.plan_processing(options, metadata_rotation, source_info=info, encoder_threads=encoder_threads)
+    if plan['display_rotation'] is not None:
+        # The new matrix replaces the source's, so keep any rotation it already has
+        plan['display_rotation'] = (plan['display_rotation'] + info['rotation']) % 360
+
+    sheet = None
+    if thumbnails_dir and plan['display_rotation'] is None and not plan['stream_copy']:
+        width, height = frame_ops.output_size(options, info['width'], info['height'])
+        sheet = ThumbnailSheet(width, height, info['duration'] / plan['speed'], thumbnail_interval)
+
+    if selected_filter != 'none' and opencv_frame_filters:
+        finished = _render_frames(input_path, output_path, options, plan, info, should_cancel,
+                                  report_progress, frame_workers, sheet)
+        if finished and sheet:
+            sheet.save(thumbnails_dir)
+        return finished
+
+    # Single pass: one decode, one filter graph, one encode
+    if plan['display_rotation'] is not None:
+        message = "Setting rotation metadata"
+    elif plan['stream_copy']:
+        message = "Copying video file"
+    else:
+        message = "Processing with FFmpeg"
+    report_progress(0.0, f"{message}...")
+    try:
+        finished = run_ffmpeg(
+            pipeline.build_output(input_path, output_path, plan, sheet.sample_rate if sheet else None),
+            should_cancel, report_progress, info['duration'] / plan['speed'], message,
+            read_stdout=_sample_reader(sheet, width, height) if sheet else None
+        )
+    except ffmpeg.Error as e:
+        raise RenderError(f"FFmpeg processing error: {e.stderr.decode('utf8')}")
+    if finished:
+        if sheet:
+            sheet.save(thumbnails_dir)
+        report_progress(1.0, "FFmpeg processing finished")
+    return finished
+
+
+def _sample_reader(sheet, width, height):
+    """Read the sampled frames of build_output's sample_rate output into sheet"""
+    def read_samples(stream):
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        while read_frame(stream, frame) is not None:
+            sheet.add(frame)
+    return read_samples
+
+
+def render_batch(input_path, outputs, should_cancel, report_progress=None, encoder_threads=0, source_info=None):
+    """Render one input to several outputs with a single decode
+
+    outputs is a list of (output_path, options). Progress is reported as
+    (fraction, message) for the outputs together, since they advance in
+    lockstep. Returns False if should_cancel was set, True on success;
+    raises RenderError on failure.
+    """
+    report_progress = report_progress or _ignore_progress
+    info = source_info or read_stream_info(input_path)
+    plans = [(output_path, pipeline.plan_processing(options, source_info=info, encoder_threads=encoder_threads))
+             for output_path, options in outputs]
+    # FFmpeg's progress reports the first output's timeline
+    expected_seconds = info['duration'] / plans[0][1]['speed']
+
+    report_progress(0.0, f"Rendering {len(plans)} outputs from one decode...")
+    try:
+        finished = run_ffmpeg(pipeline.build_batch_output(input_path, plans), should_cancel,
+                              report_progress, expected_seconds, f"Rendering {len(plans)} outputs")
+    except ffmpeg.Error as e:
+        raise RenderError(f"FFmpeg batch error: {e.stderr.decode('utf8')}")
+    if finished:
+        report_progress(1.0, "FFmpeg batch finished")
+    return finished
+
+
+def _render_growing_input(input_path, total_length, output_path, plan, should_cancel, report_progress):
+    """Single-pass render fed from an upload that is still arriving"""
+    report_progress(0.0, "Processing upload as it arrives...")
+    process = FFmpegProcess(pipeline.build_output('pipe:', output_path, plan), stdin=subprocess.PIPE)
+    try:
+        fed = feed_growing_file(
+            input_path, total_length, process.process.stdin, should_cancel,
+            lambda fraction: report_progress(fraction * 0.95, f"Processed {fraction * 100:.0f}% of upload")
+        )
+        if not fed:
+            return False
+        # Input is all in; FFmpeg still encodes what it buffered, so keep honouring cancellation
+        while process.process.poll() is None:
+            if should_cancel.wait(PROGRESS_POLL_INTERVAL):
+                return False
+        process.wait()
+    except BrokenPipeError:
+        # FFmpeg stopped reading; its stderr says why
+        process.kill()
+        raise RenderError(f"FFmpeg processing error: {process.stderr.decode('utf8')}")
+    except TimeoutError as e:
+        raise RenderError(str(e))
+    except ffmpeg.Error as e:
+        raise RenderError(f"FFmpeg processing error: {e.stderr.decode('utf8')}")
+    finally:
+        process.kill()
+
+    report_progress(1.0, "FFmpeg processing finished")
+    return True
+
+
+def _render_frames(input_path, output_path, options, plan, info, should_cancel, report_progress, frame_workers,
+                   sheet=None):
+    """Run the job's frame ops in OpenCV between an FFmpeg decoder and encoder, sampling output frames into sheet"""
+    report_progress(0.0, "Starting OpenCV processing...")
+
+    # Stream properties come from the probe or read_stream_info; the frames themselves from the FFmpeg decoder pipe
+    total_frames = info['total_frames']
+
+    # Transformations, color adjustments and the filter run in one in-loop op chain; speed inside the encoder
+    output_width, output_height = frame_ops.output_size(options, info['width'], info['height'])
+    decoder = FrameDecoder(input_path, info['width'], info['height'])
+    # A probe that found no audio saves the encoder opening the input a second time
+    audio_source = None if info.get('has_audio') is False else input_path
+    encoder = FrameEncoder(output_path, output_width, output_height, info['fps'], audio_source=audio_source,
+                           video_filters=pipeline.speed_video_filters(plan['speed'], info['fps']),
+                           audio_filters=plan['audio_filters'],
+                           encoder_options=plan['encoder'])
+
+    # The encoder retimes for speed, so frame n is shown at n / (fps * speed) seconds of the output
+    output_fps = info['fps'] * plan['speed']
+
+    def on_frame(frame_count, frame):
+        if sheet and sheet.wants((frame_count - 1) / output_fps):
+            sheet.add(frame)
+        # Update progress every 30 frames
+        if frame_count % 30 == 0 and total_frames > 0:
+            report_progress(min(frame_count / total_frames, 1.0) * 0.95,
+                            f"Processing frame {frame_count}/{total_frames}")
+
+    try:
+        frames_written = run_frame_stage(
+            decoder, encoder,
+            frame_ops.FrameOp(options, info['width'], info['height']),
+            should_cancel,
+            on_frame=on_frame,
+            workers=frame_workers
+        )
+        if frames_written is None:
+            return False
+
+        decoder.wait()
+        report_progress(0.95, "Finalizing video encoding...")
+        encoder.wait()
+    except (BrokenPipeError, ffmpeg.Error) as e:
+        # A broken pipe means the encoder exited early; its stderr says why
+        encoder.kill()
+        details = e.stderr if isinstance(e, ffmpeg.Error) else encoder.stderr
+        raise RenderError(f"Frame pipeline error: {details.decode('utf8')}")
+    finally:
+        decoder.kill()
+        encoder.kill()
+
+    report_progress(1.0, "OpenCV processing finished")
+    return True
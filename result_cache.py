@@ -0,0 +1,150 @@
+"""Content-addressed cache of processed videos
+
+Results are keyed on the SHA-256 of the uploaded bytes plus the normalized
+processing options, stored as cache_<key><ext> in the processed folder
+(the extension, and so the container, of the rendered output is kept) and
+evicted least-recently-used first once the cache exceeds its byte budget.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from pipeline import encoder_profile, parse_factor, sidecar_dir_names
+
+CACHE_PREFIX = 'cache_'
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def save_and_hash(file_storage, path):
+    """Save an uploaded file while hashing it; returns the SHA-256 hex digest"""
+    digest = hashlib.sha256()
+    with open(path, 'wb') as out:
+        for chunk in iter(lambda: file_storage.stream.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
+
+def normalize_options(options):
+    """Reduce options to the values that change the output, in canonical form"""
+    return {
+        'transformation': options.get('transformation') or 'none',
+        'filter': options.get('filter') or 'none',
+        'speed': parse_factor(options, 'speed'),
+        'brightness': parse_factor(options, 'brightness'),
+        'contrast': parse_factor(options, 'contrast'),
+        'profile': encoder_profile(options),
+    }
+
+
+def make_cache_key(content_hash, options, engine='ffmpeg'):
+    """Cache key for an input hash, its options and the rendering engine"""
+    canonical = json.dumps(normalize_options(options), sort_keys=True)
+    return hashlib.sha256(f"{content_hash}:{engine}:{canonical}".encode('utf8')).hexdigest()
+
+
+class ResultCache:
+    """Size-bounded LRU index over cached result files"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # filename -> size in bytes, least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load()
+
+    def _load(self):
+        """Index cache files already on disk, oldest first"""
+        files = []
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if filename.startswith(CACHE_PREFIX) and os.path.isfile(path):
+                files.append((os.path.getmtime(path), filename, os.path.getsize(path)))
+        for _, filename, size in sorted(files):
+            self._entries[filename] = size
+
+    def filename_for(self, key, extension):
+        """Cache filename of a result; extension is the output's, with its dot ('.mkv')"""
+        return f"{CACHE_PREFIX}{key}{extension.lower()}"
+
+    def path_for(self, key, extension):
+        return os.path.join(self.directory, self.filename_for(key, extension))
+
+    def lookup(self, key, extension):
+        """Return the cached result's filename and mark it recently used, or None"""
+        filename = self.filename_for(key, extension)
+        path = os.path.join(self.directory, filename)
+        with self._lock:
+            if not os.path.exists(path):
+                # Evicted, or deleted behind our back
+                self._entries.pop(filename, None)
+                self.misses += 1
+                return None
+            # Files stored by another process are adopted on first use
+            self._entries[filename] = os.path.getsize(path)
+            self._entries.move_to_end(filename)
+            self.hits += 1
+        # The file's mtime carries recency across restarts and processes
+        os.utime(path)
+        return filename
+
+    def store(self, key, result_path):
+        """Move a finished result, and the sidecar directories made during its render, into the cache
+
+        The result keeps its extension, since FFmpeg chose the container
+        from it. Returns the result's new path.
+        """
+        filename = self.filename_for(key, os.path.splitext(result_path)[1])
+        path = os.path.join(self.directory, filename)
+        os.replace(result_path, path)
+        for old_name, new_name in zip(sidecar_dir_names(os.path.basename(result_path)),
+                                      sidecar_dir_names(filename)):
+            old_dir = os.path.join(os.path.dirname(result_path), old_name)
+            if os.path.isdir(old_dir):
+                new_dir = os.path.join(self.directory, new_name)
+                shutil.rmtree(new_dir, ignore_errors=True)
+                os.replace(old_dir, new_dir)
+        with self._lock:
+            self._entries[filename] = os.path.getsize(path)
+            self._entries.move_to_end(filename)
+            self._evict(keep=filename)
+        return path
+
+    def _evict(self, keep):
+        total = sum(self._entries.values())
+        for filename in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if filename == keep:
+                continue
+            size = self._entries.pop(filename)
+            total -= size
+            try:
+                os.remove(os.path.join(self.directory, filename))
+                for name in sidecar_dir_names(filename):
+                    shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+                self.evictions += 1
+                print(f"🗑️ Evicted cached result {filename[:18]} ({size / (1024*1024):.1f} MB)")
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"❌ Error evicting cached result {filename[:18]}: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(self._entries.values()),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+            }
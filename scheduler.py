@@ -0,0 +1,130 @@
+"""Bounded job scheduler: a fixed worker pool fed by a priority queue, cheapest job first"""
+import itertools
+import threading
+import time
+
+# Lower value runs first; jobs with the same priority run cheapest first, then in submission order,
+# except that jobs waiting longer than max_wait go first, oldest first
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+
+
+class QueueFullError(Exception):
+    """The backlog is at its limit; the caller should retry later"""
+
+
+class JobScheduler:
+    """Run submitted jobs on a fixed number of worker threads
+
+    run_job(job_id, *args) is called on a worker thread for each job.
+    on_position(job_id, position, queued_total) is called whenever a queued
+    job's position changes (1 = next to run). Cheapest-first ordering alone
+    lets a steady stream of small jobs starve a large one, so a job that has
+    waited max_wait seconds runs ahead of the cost order (None disables it).
+    The backlog is bounded by max_queued, so the order is simply computed
+    when a job is taken.
+    """
+
+    def __init__(self, run_job, workers, max_queued, on_position=None, max_wait=None):
+        self.run_job = run_job
+        self.workers = workers
+        self.max_queued = max_queued
+        self.on_position = on_position
+        self.max_wait = max_wait
+        self._queue = []  # (priority, cost, sequence, submitted_at, job_id)
+        self._args = {}  # job_id -> args, only for jobs still queued
+        self._running = set()
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads"""
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'job-worker-{index}')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def is_full(self):
+        with self._condition:
+            return len(self._args) >= self.max_queued
+
+    def queue_depth(self):
+        with self._condition:
+            return len(self._args)
+
+    def running_count(self):
+        with self._condition:
+            return len(self._running)
+
+    def submit(self, job_id, args, priority='normal', cost=0):
+        """Queue a job and return its position; raises QueueFullError when the backlog is full
+
+        cost is the job's estimated processing cost (pipeline.estimate_cost);
+        within a priority, cheaper jobs run first so short clips don't wait
+        behind long renders.
+        """
+        with self._condition:
+            if len(self._args) >= self.max_queued:
+                raise QueueFullError(f"{len(self._args)} jobs already queued")
+            self._queue.append((PRIORITIES.get(priority, PRIORITIES['normal']), cost,
+                                next(self._sequence), time.monotonic(), job_id))
+            self._args[job_id] = args
+            positions = self._positions()
+            self._condition.notify()
+        self._publish_positions(positions)
+        return positions.get(job_id, 0)
+
+    def cancel(self, job_id):
+        """Drop a job that has not started yet; returns True if it was queued"""
+        with self._condition:
+            if job_id not in self._args:
+                return False
+            del self._args[job_id]
+            self._queue = [entry for entry in self._queue if entry[-1] != job_id]
+            positions = self._positions()
+        self._publish_positions(positions)
+        return True
+
+    def position(self, job_id):
+        """1-based queue position of a waiting job, or None if it is not queued"""
+        with self._condition:
+            return self._positions().get(job_id)
+
+    def _order_key(self, entry, now):
+        priority, cost, sequence, submitted_at, _ = entry
+        if self.max_wait is not None and now - submitted_at >= self.max_wait:
+            return priority, 0, sequence  # overdue: first in, first out
+        return priority, 1, cost, sequence
+
+    def _ordered(self):
+        now = time.monotonic()
+        return sorted(self._queue, key=lambda entry: self._order_key(entry, now))
+
+    def _positions(self):
+        return {entry[-1]: index + 1 for index, entry in enumerate(self._ordered())}
+
+    def _publish_positions(self, positions):
+        if self.on_position:
+            for job_id, position in positions.items():
+                self.on_position(job_id, position, len(positions))
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                entry = self._ordered()[0]
+                self._queue.remove(entry)
+                job_id = entry[-1]
+                args = self._args.pop(job_id)
+                self._running.add(job_id)
+                positions = self._positions()
+            self._publish_positions(positions)
+            try:
+                self.run_job(job_id, *args)
+            except Exception as e:
+                print(f"❌ Job {job_id} crashed in scheduler worker: {e}")
+            finally:
+                with self._condition:
+                    self._running.discard(job_id)
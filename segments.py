@@ -0,0 +1,171 @@
+"""Segment-parallel rendering: split at keyframes, render chunks in processes, concat
+
+The input is cut with the segment muxer (stream copy, so every cut lands on
+a keyframe), each segment is rendered by render.render_video in its own
+process, and the outputs are joined with the concat demuxer without
+re-encoding.
+"""
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_EXCEPTION
+
+import ffmpeg
+
+import render
+from frame_stream import run_ffmpeg
+from pipeline import FASTSTART
+
+# Set in each segment process by _init_segment_process
+_cancel_event = None
+_progress_queue = None
+
+
+def _init_segment_process(cancel_event, progress_queue):
+    global _cancel_event, _progress_queue
+    _cancel_event = cancel_event
+    _progress_queue = progress_queue
+
+
+def _render_segment(index, segment_input, segment_output, options, render_kwargs):
+    """Render one segment inside a worker process"""
+    def report_progress(fraction, message):
+        _progress_queue.put((index, fraction))
+
+    return render.render_video(segment_input, segment_output, options, _cancel_event,
+                               report_progress, **render_kwargs)
+
+
+def keyframe_cuts(keyframes, duration, segment_count):
+    """Keyframe timestamps nearest to segment_count even split points, without duplicates or 0"""
+    cuts = []
+    for index in range(1, segment_count):
+        target = duration * index / segment_count
+        nearest = min(keyframes, key=lambda keyframe: abs(keyframe - target))
+        if nearest > 0 and nearest not in cuts:
+            cuts.append(nearest)
+    return sorted(cuts)
+
+
+def split_at_keyframes(input_path, work_dir, segment_count, duration, should_cancel, cuts=None):
+    """Stream-copy the input into roughly equal segments cut at keyframes; None if cancelled
+
+    cuts are exact keyframe timestamps from the probe; without them the
+    segment muxer cuts at the first keyframe after each even split point.
+    """
+    pattern = os.path.join(work_dir, 'source_%03d.mkv')
+    if cuts:
+        split = {'segment_times': ','.join(f'{cut:.6f}' for cut in cuts)}
+    else:
+        split = {'segment_time': f'{duration / segment_count:.3f}'}
+    # Only the streams the render uses: Matroska can't carry data tracks such as QuickTime timecode
+    source = ffmpeg.input(input_path)
+    try:
+        finished = run_ffmpeg(ffmpeg.output(
+            source['v:0'], source['a?'], pattern, format='segment', c='copy', reset_timestamps=1, **split
+        ), should_cancel)
+    except ffmpeg.Error as e:
+        raise render.RenderError(f"Segment split error: {e.stderr.decode('utf8')}")
+    if not finished:
+        return None
+
+    return sorted(
+        os.path.join(work_dir, name) for name in os.listdir(work_dir)
+        if name.startswith('source_')
+    )
+
+
+def concat_segments(segment_paths, output_path, work_dir, should_cancel):
+    """Join rendered segments with the concat demuxer (no re-encode); False if cancelled"""
+    list_path = os.path.join(work_dir, 'segments.txt')
+    with open(list_path, 'w') as list_file:
+        for path in segment_paths:
+            list_file.write(f"file '{os.path.abspath(path)}'\n")
+    try:
+        return run_ffmpeg(ffmpeg.input(list_path, format='concat', safe=0)
+                                .output(output_path, c='copy', movflags=FASTSTART), should_cancel)
+    except ffmpeg.Error as e:
+        raise render.RenderError(f"Segment concat error: {e.stderr.decode('utf8')}")
+
+
+def render_segmented(input_path, output_path, options, should_cancel, report_progress,
+                     segment_count, opencv_frame_filters=False, frame_workers=1, encoder_threads=0,
+                     source_info=None):
+    """Render input_path in parallel segments; same contract as render.render_video
+
+    With a probe that indexed the keyframes (source_info from
+    probe.probe_input), the cuts are placed on them directly, and an input
+    with a single keyframe is rendered in one piece instead of being
+    "split" into one segment plus empty ones.
+    """
+    info = source_info or render.read_stream_info(input_path)
+    keyframes = info.get('keyframes')
+    cuts = keyframe_cuts(keyframes, info['duration'], segment_count) if keyframes else None
+    if info['duration'] <= 0 or (keyframes is not None and not cuts):
+        # Without a duration or a second keyframe there is nowhere to cut; render in one piece
+        return render.render_video(input_path, output_path, options, should_cancel, report_progress,
+                                   opencv_frame_filters=opencv_frame_filters, frame_workers=frame_workers,
+                                   encoder_threads=encoder_threads, source_info=source_info)
+
+    work_dir = tempfile.mkdtemp(prefix='segments_')
+    try:
+        report_progress(0.0, f"Splitting video into {segment_count} segments...")
+        sources = split_at_keyframes(input_path, work_dir, segment_count, info['duration'], should_cancel, cuts)
+        if sources is None:
+            return False
+        outputs = [os.path.join(work_dir, f'rendered_{index:03d}.mp4') for index in range(len(sources))]
+
+        # Processes are spawned, not forked, so they don't inherit the web server's threads and sockets
+        context = multiprocessing.get_context('spawn')
+        cancel_event = context.Event()
+        progress_queue = context.Queue()
+        render_kwargs = {
+            'opencv_frame_filters': opencv_frame_filters,
+            # Share the frame threads between segments instead of multiplying them
+            'frame_workers': max(1, frame_workers // len(sources)),
+            # Likewise the encoder threads, unless a count was configured
+            'encoder_threads': encoder_threads or max(1, (os.cpu_count() or 1) // len(sources)),
+        }
+        fractions = [0.0] * len(sources)
+
+        with ProcessPoolExecutor(max_workers=len(sources), mp_context=context,
+                                 initializer=_init_segment_process,
+                                 initargs=(cancel_event, progress_queue)) as pool:
+            futures = [
+                pool.submit(_render_segment, index, source, output, options, render_kwargs)
+                for index, (source, output) in enumerate(zip(sources, outputs))
+            ]
+            pending = set(futures)
+            while pending:
+                if should_cancel.is_set():
+                    cancel_event.set()
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_EXCEPTION)
+                for future in done:
+                    if future.exception():
+                        cancel_event.set()
+                        raise future.exception()
+                    fractions[futures.index(future)] = 1.0
+
+                # Combine the segments' progress into one value for the job
+                try:
+                    while True:
+                        index, fraction = progress_queue.get_nowait()
+                        fractions[index] = max(fractions[index], fraction)
+                except queue.Empty:
+                    pass
+                finished = len(futures) - len(pending)
+                report_progress(0.05 + 0.9 * sum(fractions) / len(fractions),
+                                f"Rendering segments ({finished}/{len(futures)} done)")
+
+        if should_cancel.is_set() or not all(future.result() for future in futures):
+            return False
+
+        report_progress(0.95, "Joining segments...")
+        if not concat_segments(outputs, output_path, work_dir, should_cancel):
+            return False
+        report_progress(1.0, "Segments joined")
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
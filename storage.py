@@ -0,0 +1,223 @@
+"""Byte-budget and TTL storage manager for uploads and processed outputs
+
+Files are indexed when they are created, with their size and last access,
+so eviction never has to list or stat the folders. Jobs hold explicit
+references to the files they read or write; referenced files are never
+evicted. A background sweeper deletes unreferenced files whose last access
+is older than the TTL, then the least recently used ones until the total is
+within the byte budget. Cached results (cache_*) are managed by result_cache.
+
+With shared (a Redis client), the index and the references live in Redis
+instead, so several processes sharing the folders see the same sizes and
+last accesses, never evict each other's inputs and any of them can release
+a job. Each sweep runs in one process only, under a lock that expires after
+the sweep interval. References expire after the TTL, so a crashed process
+can't pin files forever.
+
+before_sweep, if given, runs at the start of every sweep, for files that
+are not indexed yet (abandoned chunked uploads).
+"""
+import os
+import shutil
+import threading
+import time
+
+from pipeline import sidecar_dir_names
+
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.webm', '.flv', '.wmv'}
+SHARED_REFS_PREFIX = 'storage:refs:'  # + job_id: set of paths the job holds
+SHARED_ACCESSED_KEY = 'storage:accessed'  # sorted set: path scored by last access
+SHARED_SIZES_KEY = 'storage:sizes'  # hash: path -> bytes
+SWEEP_LOCK_KEY = 'storage:sweep_lock'
+
+
+class StorageManager:
+    """Index of stored videos, in memory or in Redis, with reference-protected eviction"""
+
+    def __init__(self, folders, max_bytes, ttl_seconds, sweep_interval=60, skip_prefixes=(), shared=None,
+                 before_sweep=None):
+        self.folders = folders
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+        self.skip_prefixes = tuple(skip_prefixes)
+        self.shared = shared
+        self.before_sweep = before_sweep
+        self._entries = {}  # path -> {'size', 'accessed'}, unless shared
+        self._refs = {}  # job_id -> set of paths the job holds, unless shared
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self._load()
+
+    def _load(self):
+        """Index the videos already on disk; the only directory scan, done once at startup"""
+        found = {}
+        for folder in self.folders:
+            if not os.path.isdir(folder):
+                continue
+            for filename in os.listdir(folder):
+                if filename.startswith('.') or filename.startswith(self.skip_prefixes):
+                    continue
+                if os.path.splitext(filename)[1].lower() not in VIDEO_EXTENSIONS:
+                    continue
+                path = os.path.join(folder, filename)
+                if os.path.isfile(path):
+                    found[os.path.abspath(path)] = {'size': os.path.getsize(path), 'accessed': os.path.getmtime(path)}
+        if not self.shared:
+            self._entries = found
+        elif found:
+            # Another process may have indexed them already, with a later access
+            pipe = self.shared.pipeline()
+            pipe.zadd(SHARED_ACCESSED_KEY, {path: entry['accessed'] for path, entry in found.items()}, nx=True)
+            for path, entry in found.items():
+                pipe.hsetnx(SHARED_SIZES_KEY, path, entry['size'])
+            pipe.execute()
+
+    def start(self):
+        """Start the background sweeper"""
+        thread = threading.Thread(target=self._sweep_loop, name='storage-sweeper')
+        thread.daemon = True
+        thread.start()
+
+    def add(self, path, job_id=None):
+        """Index a file that was just written, optionally referenced by job_id"""
+        path = os.path.abspath(path)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return
+        if self.shared:
+            pipe = self.shared.pipeline()
+            pipe.zadd(SHARED_ACCESSED_KEY, {path: time.time()}).hset(SHARED_SIZES_KEY, path, size)
+            if job_id:
+                key = SHARED_REFS_PREFIX + job_id
+                pipe.sadd(key, path).expire(key, self.ttl_seconds)
+            pipe.execute()
+            return
+        with self._lock:
+            self._entries[path] = {'size': size, 'accessed': time.time()}
+            if job_id:
+                self._refs.setdefault(job_id, set()).add(path)
+
+    def release(self, job_id):
+        """Drop a finished job's references; its files age out like any other"""
+        if self.shared:
+            key = SHARED_REFS_PREFIX + job_id
+            paths, _ = self.shared.pipeline().smembers(key).delete(key).execute()
+            # Inputs may have grown (streamed uploads) or been deleted while the job ran
+            for path in paths:
+                if self.shared.hexists(SHARED_SIZES_KEY, path):
+                    try:
+                        self.shared.hset(SHARED_SIZES_KEY, path, os.path.getsize(path))
+                    except FileNotFoundError:
+                        self.shared.pipeline().zrem(SHARED_ACCESSED_KEY, path).hdel(SHARED_SIZES_KEY, path).execute()
+            return
+        with self._lock:
+            for path in self._refs.pop(job_id, set()):
+                if path not in self._entries:
+                    continue
+                try:
+                    self._entries[path]['size'] = os.path.getsize(path)
+                except FileNotFoundError:
+                    del self._entries[path]
+
+    def touch(self, path):
+        """Mark a file as just accessed (downloaded or played)"""
+        path = os.path.abspath(path)
+        if self.shared:
+            self.shared.zadd(SHARED_ACCESSED_KEY, {path: time.time()}, xx=True)
+            return
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry:
+                entry['accessed'] = time.time()
+
+    def sweep(self):
+        """Evict expired files, then least recently used ones down to the byte budget; returns how many"""
+        if self.before_sweep:
+            self.before_sweep()
+        if self.shared:
+            victims = self._select_shared_victims()
+        else:
+            victims = self._select_victims()
+
+        for path in victims:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                # Drop the HLS package and thumbnails generated from this file, if any
+                for name in sidecar_dir_names(os.path.basename(path)):
+                    shutil.rmtree(os.path.join(os.path.dirname(path), name), ignore_errors=True)
+                self.evictions += 1
+                print(f"🗑️ Evicted stored video: {os.path.basename(path)} ({size / (1024*1024):.1f} MB)")
+            except FileNotFoundError:
+                pass  # deleted behind our back
+            except Exception as e:
+                print(f"❌ Error evicting {path}: {e}")
+        return len(victims)
+
+    def _select_victims(self):
+        """Remove the files to evict from the in-memory index and return their paths"""
+        now = time.time()
+        with self._lock:
+            referenced = set().union(*self._refs.values())
+            candidates = sorted(
+                (entry['accessed'], path) for path, entry in self._entries.items() if path not in referenced
+            )
+            total = sum(entry['size'] for entry in self._entries.values())
+            victims = []
+            for accessed, path in candidates:
+                if now - accessed <= self.ttl_seconds and total <= self.max_bytes:
+                    break
+                total -= self._entries.pop(path)['size']
+                victims.append(path)
+        return victims
+
+    def _select_shared_victims(self):
+        """Like _select_victims for the Redis index; nothing if another process holds this sweep"""
+        if not self.shared.set(SWEEP_LOCK_KEY, 1, nx=True, ex=max(1, int(self.sweep_interval))):
+            return []
+        now = time.time()
+        referenced = set()
+        for key in self.shared.scan_iter(match=SHARED_REFS_PREFIX + '*'):
+            referenced |= self.shared.smembers(key)
+        sizes = {path: int(size) for path, size in self.shared.hgetall(SHARED_SIZES_KEY).items()}
+        total = sum(sizes.values())
+        victims = []
+        for path, accessed in self.shared.zrange(SHARED_ACCESSED_KEY, 0, -1, withscores=True):
+            if now - accessed <= self.ttl_seconds and total <= self.max_bytes:
+                break
+            if path in referenced:
+                continue
+            total -= sizes.get(path, 0)
+            victims.append(path)
+        if victims:
+            self.shared.pipeline().zrem(SHARED_ACCESSED_KEY, *victims).hdel(SHARED_SIZES_KEY, *victims).execute()
+        return victims
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"❌ Storage sweep failed: {e}")
+            time.sleep(self.sweep_interval)
+
+    def stats(self):
+        if self.shared:
+            files, sizes = self.shared.pipeline().zcard(SHARED_ACCESSED_KEY).hvals(SHARED_SIZES_KEY).execute()
+            total = sum(int(size) for size in sizes)
+            referenced = sum(1 for _ in self.shared.scan_iter(match=SHARED_REFS_PREFIX + '*'))
+        else:
+            with self._lock:
+                files = len(self._entries)
+                total = sum(entry['size'] for entry in self._entries.values())
+                referenced = len(self._refs)
+        return {
+            'files': files,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl_seconds,
+            'referenced_jobs': referenced,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,148 @@
+"""Worker tier against fakeredis: enqueue, work() to completion, the cancel flag and requeueing
+
+app.py connects to Redis when it is imported, so redis.Redis is replaced by
+fakeredis.FakeRedis for the import and the module runs in a scratch folder.
+"""
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+
+import fakeredis
+import pytest
+import redis
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="needs the ffmpeg binary")
+
+
+@pytest.fixture(scope='module')
+def worker(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp('worker')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(redis, 'Redis', fakeredis.FakeRedis)
+        patch.syspath_prepend(ROOT)
+        patch.setenv('JOB_BACKEND', 'redis')
+        patch.setenv('PUBLISH_EVENTS_TO_REDIS', '1')
+        import worker as worker_module
+        yield worker_module
+    os.chdir(cwd)
+
+
+@pytest.fixture(scope='module')
+def clip(worker):
+    """A short test pattern video in the upload folder"""
+    path = os.path.join(worker.web.app.config['UPLOAD_FOLDER'], 'clip.mp4')
+    subprocess.run(['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', 'testsrc=size=320x240:rate=25:duration=4',
+                    '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', path], check=True)
+    return path
+
+
+def enqueue(worker, clip, options=None):
+    """Queue a job the way the web process does and return its id and output path"""
+    web = worker.web
+    job_id = str(uuid.uuid4())
+    input_path = os.path.join(web.app.config['UPLOAD_FOLDER'], f"{job_id}_clip.mp4")
+    shutil.copy(clip, input_path)
+    output_path = os.path.join(web.app.config['PROCESSED_FOLDER'], f"processed_{job_id}_clip.mp4")
+    options = dict({'filter': 'blur', 'profile': 'fast'}, **(options or {}))
+    web.start_uploaded_job(job_id, input_path, output_path, options, 'clip.mp4', 'normal')
+    return job_id, output_path
+
+
+def test_backend_is_redis(worker):
+    assert worker.web.REDIS_AVAILABLE
+    assert worker.web.app.config['JOB_BACKEND'] == 'redis'
+
+
+def test_work_runs_enqueued_job(worker, clip):
+    web = worker.web
+    job_id, output_path = enqueue(worker, clip)
+    assert web.queue_position(job_id) == 1
+
+    assert worker.work(max_jobs=1) == 1
+
+    job = web.get_job_status(job_id)
+    assert job['status'] == 'completed', job.get('error')
+    assert job['output_filename'] == os.path.basename(output_path)
+    assert os.path.getsize(output_path) > 0
+    assert web.queue_position(job_id) is None
+    assert job_id not in web.worker_job_ids()
+    assert not web.redis_client.exists(f"job:{job_id}:payload")
+
+
+def test_cancel_before_start_removes_job_from_queue(worker, clip):
+    web = worker.web
+    job_id, output_path = enqueue(worker, clip)
+
+    assert web.cancel_job(job_id)
+
+    assert web.queue_position(job_id) is None
+    assert all(web.redis_client.llen(key) == 0 for key in web.JOB_QUEUE_KEYS)
+    assert web.get_job_status(job_id)['status'] == 'cancelled'
+    assert not os.path.exists(output_path)
+
+
+def test_cancel_flag_skips_dequeued_job(worker, clip):
+    web = worker.web
+    job_id, output_path = enqueue(worker, clip)
+    web.redis_client.set(f"job:{job_id}:cancel", 1)
+
+    assert web.redis_client.exists(f"storage:refs:{job_id}")
+
+    worker.work(max_jobs=1)
+
+    assert web.get_job_status(job_id)['status'] == 'cancelled'
+    assert not os.path.exists(output_path)
+    assert not web.redis_client.exists(f"job:{job_id}:payload", f"job:{job_id}:cancel")
+    assert not web.redis_client.exists(f"storage:refs:{job_id}")
+
+
+def test_cancel_flag_stops_running_job(worker, clip, monkeypatch):
+    web = worker.web
+    monkeypatch.setattr(worker, 'CANCEL_POLL_INTERVAL', 0.05)
+    # Slow enough to still be running when the flag is seen
+    job_id, output_path = enqueue(worker, clip, {'profile': 'archive', 'filter': 'sharpen'})
+    thread = threading.Thread(target=worker.work, kwargs={'max_jobs': 1})
+    thread.start()
+
+    deadline = time.monotonic() + 10
+    while job_id not in web.worker_job_ids():
+        assert time.monotonic() < deadline, "the worker never picked the job up"
+        time.sleep(0.01)
+    # What cancel_remote_job sets for a job running in another process
+    web.redis_client.set(f"job:{job_id}:cancel", 1)
+    thread.join(timeout=30)
+
+    assert not thread.is_alive()
+    assert web.get_job_status(job_id)['status'] != 'completed'
+    assert not os.path.exists(output_path)
+    assert job_id not in web.worker_job_ids()
+    assert not web.redis_client.exists(f"job:{job_id}:cancel")
+
+
+def test_jobs_of_dead_worker_are_requeued(worker, clip):
+    web = worker.web
+    job_id, output_path = enqueue(worker, clip)
+    # Taken by a worker that died without a heartbeat left
+    dead_key = worker.processing_key('gone-host:1')
+    web.redis_client.lmove('jobs:queue:normal', dead_key, 'LEFT', 'RIGHT')
+    web.redis_client.sadd(web.JOB_WORKERS_KEY, 'gone-host:1')
+    web.write_job_fields(job_id, {'status': 'processing'})
+    assert job_id not in web.worker_job_ids()
+
+    assert worker.requeue_orphaned_jobs() == 1
+
+    assert web.queue_position(job_id) == 1
+    assert web.get_job_status(job_id)['status'] == 'queued'
+    assert not web.redis_client.exists(dead_key)
+    assert not web.redis_client.sismember(web.JOB_WORKERS_KEY, 'gone-host:1')
+
+    assert worker.work(max_jobs=1) == 1
+    assert web.get_job_status(job_id)['status'] == 'completed'
+    assert os.path.getsize(output_path) > 0
@@ -0,0 +1,109 @@
+"""Poster image and WebVTT-indexed thumbnail sprite, sampled while a video is rendered
+
+Rendered frames are sampled every `interval` seconds of the output and
+downscaled with cv2.resize straight into their tile of a preallocated
+mosaic, so no frame is decoded twice and nothing is allocated per sample.
+The OpenCV frame loop feeds its output frames in; the FFmpeg single pass
+adds a second output from the same decode that drops frames to one per
+interval before the job's filters run (pipeline.build_output).
+"""
+import os
+
+import cv2
+import numpy as np
+
+POSTER_FILENAME = 'poster.jpg'
+SPRITE_FILENAME = 'sprite.jpg'
+VTT_FILENAME = 'thumbnails.vtt'
+
+TILE_WIDTH = 160
+SPRITE_COLUMNS = 10
+POSTER_MAX_WIDTH = 640
+POSTER_POSITION = 0.1  # fraction of the video the poster is taken at, past fades from black
+JPEG_QUALITY = 80
+MAX_TILES = 100
+
+
+def _even(value):
+    return max(2, int(round(value / 2)) * 2)
+
+
+class ThumbnailSheet:
+    """Mosaic of frames sampled every interval seconds, plus a larger poster frame
+
+    width/height are the rendered frame size, duration the output's length.
+    Long videos sample less often so the sheet stays at max_tiles. Sheets
+    are written to pipeline.thumbnails_dir_name(output) by save().
+    """
+
+    def __init__(self, width, height, duration, interval=2.0, max_tiles=MAX_TILES):
+        self.duration = duration
+        self.interval = max(interval, duration / max_tiles) if duration > 0 else interval
+        self.count = min(max_tiles, int(duration / self.interval) + 1) if duration > 0 else max_tiles
+        self.tile_width = TILE_WIDTH
+        self.tile_height = _even(TILE_WIDTH * height / width)
+        self.columns = min(SPRITE_COLUMNS, self.count)
+        rows = -(-self.count // self.columns)
+        self.mosaic = np.zeros((rows * self.tile_height, self.columns * self.tile_width, 3), dtype=np.uint8)
+
+        poster_width = min(POSTER_MAX_WIDTH, _even(width))
+        self.poster = np.zeros((_even(poster_width * height / width), poster_width, 3), dtype=np.uint8)
+        self.poster_index = min(int(duration * POSTER_POSITION / self.interval), self.count - 1)
+        self.tiles = 0
+
+    @property
+    def sample_rate(self):
+        """Samples per second of output, for FFmpeg's fps filter"""
+        return 1.0 / self.interval
+
+    def wants(self, timestamp):
+        """Whether the frame at this output timestamp (seconds) is the next sample"""
+        return self.tiles < self.count and timestamp >= self.tiles * self.interval
+
+    def add(self, frame):
+        """Downscale a BGR frame into the next tile (and the poster); ignored once the sheet is full"""
+        if self.tiles >= self.count:
+            return
+        row, column = divmod(self.tiles, self.columns)
+        y, x = row * self.tile_height, column * self.tile_width
+        tile = self.mosaic[y:y + self.tile_height, x:x + self.tile_width]
+        cv2.resize(frame, (self.tile_width, self.tile_height), dst=tile, interpolation=cv2.INTER_AREA)
+        if self.tiles == self.poster_index:
+            cv2.resize(frame, (self.poster.shape[1], self.poster.shape[0]), dst=self.poster,
+                       interpolation=cv2.INTER_AREA)
+        self.tiles += 1
+
+    def save(self, directory):
+        """Write the poster, the sprite (only the rows in use) and its WebVTT index; False if nothing was sampled"""
+        if not self.tiles:
+            return False
+        os.makedirs(directory, exist_ok=True)
+        rows = -(-self.tiles // self.columns)
+        quality = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+        cv2.imwrite(os.path.join(directory, SPRITE_FILENAME), self.mosaic[:rows * self.tile_height], quality)
+        poster = self.poster if self.tiles > self.poster_index else None
+        if poster is None:
+            # Shorter than expected: the first tile is the best frame there is
+            poster = cv2.resize(self.mosaic[:self.tile_height, :self.tile_width],
+                                (self.poster.shape[1], self.poster.shape[0]), interpolation=cv2.INTER_LINEAR)
+        cv2.imwrite(os.path.join(directory, POSTER_FILENAME), poster, quality)
+
+        cues = ['WEBVTT', '']
+        for index in range(self.tiles):
+            row, column = divmod(index, self.columns)
+            end = (index + 1) * self.interval
+            if self.duration > 0:
+                end = min(end, max(self.duration, index * self.interval + 0.001))
+            cues.append(f"{_vtt_time(index * self.interval)} --> {_vtt_time(end)}")
+            cues.append(f"{SPRITE_FILENAME}#xywh={column * self.tile_width},{row * self.tile_height},"
+                        f"{self.tile_width},{self.tile_height}")
+            cues.append('')
+        with open(os.path.join(directory, VTT_FILENAME), 'w') as f:
+            f.write('\n'.join(cues))
+        return True
+
+
+def _vtt_time(seconds):
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
@@ -0,0 +1,183 @@
+"""Chunked, resumable uploads and reading a file while it is still being uploaded
+
+An upload session is created with the final length up front, then filled by
+appending chunks at the offset the server reports, so an interrupted client
+can ask for the offset and carry on. Because the final length is known, a
+reader can follow the growing file and know exactly when it is complete.
+"""
+import hashlib
+import os
+import struct
+import threading
+import time
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+FOLLOW_POLL_INTERVAL = 0.2  # seconds between checks for new bytes
+
+# Containers FFmpeg can demux front to back without seeking
+STREAMABLE_EXTENSIONS = {'mkv', 'webm'}
+ISO_BMFF_EXTENSIONS = {'mp4', 'mov'}
+
+
+class UploadError(Exception):
+    """A chunk could not be applied; status is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadStore:
+    """In-memory registry of upload sessions
+
+    Sessions that receive no chunk for session_ttl seconds are abandoned:
+    expire() drops them and deletes their partial files.
+    """
+
+    def __init__(self, session_ttl=3600):
+        self.session_ttl = session_ttl
+        self._sessions = {}  # upload_id -> session dict
+        self._lock = threading.Lock()
+
+    def create(self, upload_id, path, filename, length, options, priority='normal', stream=False):
+        session = {
+            'id': upload_id,
+            'path': path,
+            'filename': filename,
+            'length': length,
+            'offset': 0,
+            'options': options,
+            'priority': priority,
+            'stream': stream,
+            'job_started': False,
+            'updated_at': time.time(),  # creation or last chunk, for expire()
+            '_sha256': hashlib.sha256(),
+            '_lock': threading.Lock(),
+        }
+        open(path, 'wb').close()
+        with self._lock:
+            self._sessions[upload_id] = session
+        return session
+
+    def get(self, upload_id):
+        with self._lock:
+            return self._sessions.get(upload_id)
+
+    def remove(self, upload_id):
+        with self._lock:
+            return self._sessions.pop(upload_id, None)
+
+    def expire(self):
+        """Drop sessions idle for longer than session_ttl and delete their files; returns how many
+
+        A session whose job already started (a streaming upload) keeps its
+        file: the job holds it and fails on its own once the bytes stop.
+        """
+        cutoff = time.time() - self.session_ttl
+        with self._lock:
+            stale = [session for session in self._sessions.values() if session['updated_at'] < cutoff]
+            for session in stale:
+                del self._sessions[session['id']]
+        for session in stale:
+            if session['job_started']:
+                continue
+            # Wait for a chunk that is still being written
+            with session['_lock']:
+                try:
+                    os.remove(session['path'])
+                except FileNotFoundError:
+                    pass
+            print(f"🗑️ Expired abandoned upload {session['filename']} ({session['offset']} of {session['length']} bytes)")
+        return len(stale)
+
+    def append(self, upload_id, offset, stream):
+        """Append a chunk read from stream at offset; returns the session
+
+        Chunks must arrive in order: an offset other than the current one is
+        rejected with 409 so the client re-syncs via the reported offset.
+        """
+        session = self.get(upload_id)
+        if not session:
+            raise UploadError("Upload not found", 404)
+        with session['_lock']:
+            if self.get(upload_id) is not session:
+                raise UploadError("Upload expired", 404)  # expire() got it first
+            if offset != session['offset']:
+                raise UploadError(f"Offset mismatch: upload is at {session['offset']}", 409)
+            with open(session['path'], 'ab') as out:
+                for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+                    if session['offset'] + len(chunk) > session['length']:
+                        raise UploadError("Chunk goes past the declared upload length", 413)
+                    out.write(chunk)
+                    # Make the bytes visible to a reader following the file
+                    out.flush()
+                    session['_sha256'].update(chunk)
+                    session['offset'] += len(chunk)
+                    session['updated_at'] = time.time()
+        return session
+
+    @staticmethod
+    def content_hash(session):
+        """SHA-256 of the complete upload"""
+        return session['_sha256'].hexdigest()
+
+
+def is_streamable_prefix(path, filename):
+    """Whether FFmpeg can read this upload front to back while it grows
+
+    Returns True or False, or None if the bytes received so far don't tell
+    yet (an MP4/MOV whose first boxes are still arriving).
+    """
+    ext = filename.rsplit('.', 1)[-1].lower()
+    if ext in STREAMABLE_EXTENSIONS:
+        return True
+    if ext not in ISO_BMFF_EXTENSIONS:
+        return False
+
+    # MP4/MOV: readable from a pipe only if 'moov' precedes 'mdat' (faststart)
+    size = os.path.getsize(path)
+    position = 0
+    with open(path, 'rb') as f:
+        while position + 8 <= size:
+            f.seek(position)
+            box_size, box_type = struct.unpack('>I4s', f.read(8))
+            if box_type == b'moov':
+                return True
+            if box_type == b'mdat':
+                return False
+            if box_size == 1:
+                if position + 16 > size:
+                    return None
+                box_size = struct.unpack('>Q', f.read(8))[0]
+            if box_size < 8:
+                return False
+            position += box_size
+    return None
+
+
+def feed_growing_file(path, total_length, out_stream, should_cancel, report_fraction=None,
+                      stall_timeout=120):
+    """Copy a file that is still being written into out_stream, then close it
+
+    Stops after total_length bytes. Returns False if cancelled; raises
+    TimeoutError if no new bytes arrive for stall_timeout seconds.
+    """
+    copied = 0
+    last_growth = time.monotonic()
+    with open(path, 'rb') as source:
+        while copied < total_length:
+            if should_cancel.is_set():
+                return False
+            chunk = source.read(min(UPLOAD_CHUNK_SIZE, total_length - copied))
+            if not chunk:
+                if time.monotonic() - last_growth > stall_timeout:
+                    raise TimeoutError(f"Upload stalled at {copied} of {total_length} bytes")
+                time.sleep(FOLLOW_POLL_INTERVAL)
+                continue
+            last_growth = time.monotonic()
+            out_stream.write(chunk)
+            copied += len(chunk)
+            if report_fraction:
+                report_fraction(copied / total_length)
+    out_stream.close()
+    return True
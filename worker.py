@@ -0,0 +1,183 @@
+"""Transcoding worker: runs queued jobs outside the web process
+
+Start any number of these with `python -m worker` on hosts that share the
+upload/processed folders and the Redis server. Web processes started with
+JOB_BACKEND=redis only enqueue jobs and relay the progress events workers
+publish.
+
+Each worker moves the jobs it takes into its own jobs:processing:<worker id>
+list and keeps a heartbeat key alive while it runs. A worker that starts
+puts the jobs of workers whose heartbeat expired back on their queues, so a
+crashed worker doesn't lose them.
+"""
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+
+# Workers never serve browsers: queue through Redis and publish events there
+os.environ.setdefault('JOB_BACKEND', 'redis')
+os.environ.setdefault('PUBLISH_EVENTS_TO_REDIS', '1')
+# Web processes relay worker events to their own clients, so workers stay off the Socket.IO message queue
+os.environ.pop('SOCKETIO_MESSAGE_QUEUE', None)
+
+import app as web
+
+CANCEL_POLL_INTERVAL = 1.0  # seconds
+HEARTBEAT_INTERVAL = 10  # seconds
+HEARTBEAT_TTL = 30  # seconds without a heartbeat before a worker counts as dead
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def processing_key(worker_id=WORKER_ID):
+    return web.JOB_PROCESSING_PREFIX + worker_id
+
+
+def heartbeat():
+    """Register this worker and mark it alive for another HEARTBEAT_TTL seconds"""
+    pipe = web.redis_client.pipeline()
+    pipe.sadd(web.JOB_WORKERS_KEY, WORKER_ID)
+    pipe.set(web.WORKER_HEARTBEAT_PREFIX + WORKER_ID, 1, ex=HEARTBEAT_TTL)
+    pipe.execute()
+
+
+def keep_alive():
+    while True:
+        try:
+            heartbeat()
+        except Exception as e:
+            print(f"❌ Worker heartbeat failed: {e}")
+        time.sleep(HEARTBEAT_INTERVAL)
+
+
+def requeue_orphaned_jobs():
+    """Put the jobs of workers that stopped heartbeating back at the front of their queues"""
+    requeued = 0
+    for worker_id in web.redis_client.smembers(web.JOB_WORKERS_KEY):
+        if worker_id == WORKER_ID or web.redis_client.exists(web.WORKER_HEARTBEAT_PREFIX + worker_id):
+            continue
+        key = processing_key(worker_id)
+        # Oldest last, so the queue keeps the order the dead worker took them in
+        for job_id in reversed(web.redis_client.lrange(key, 0, -1)):
+            # Whoever removes the entry requeues it, should two workers start at once
+            if not web.redis_client.lrem(key, 1, job_id):
+                continue
+            payload = web.redis_client.get(f"job:{job_id}:payload")
+            if not payload:
+                continue  # finished or cancelled before the worker died
+            web.redis_client.lpush(json.loads(payload).get('queue_key', 'jobs:queue:normal'), job_id)
+            web.write_job_fields(job_id, {'status': 'queued', 'progress': 0,
+                                          'message': 'Requeued after its worker stopped'})
+            requeued += 1
+        if not web.redis_client.llen(key):
+            web.redis_client.srem(web.JOB_WORKERS_KEY, worker_id)
+    if requeued:
+        print(f"♻️ Requeued {requeued} job(s) left by stopped workers")
+    return requeued
+
+
+def watch_for_cancel(job_id, should_cancel, stop_watching):
+    """Turn the job's Redis cancel flag into its local should_cancel event"""
+    while not stop_watching.wait(CANCEL_POLL_INTERVAL):
+        if web.redis_client.exists(f"job:{job_id}:cancel"):
+            should_cancel.set()
+            return
+
+
+def run_job(job_id):
+    """Process one dequeued job with the same pipeline the web process uses"""
+    payload = web.redis_client.get(f"job:{job_id}:payload")
+    if not payload:
+        print(f"❌ Job {job_id} has no payload, skipping")
+        return
+    if web.redis_client.exists(f"job:{job_id}:cancel"):
+        # Cancelled while it waited in this worker's hands
+        web.redis_client.delete(f"job:{job_id}:payload", f"job:{job_id}:cancel")
+        web.mark_job_cancelled(job_id)
+        return
+    job = json.loads(payload)
+
+    should_cancel = threading.Event()
+    web.active_jobs[job_id] = {
+        'thread': threading.current_thread(),
+        'should_cancel': should_cancel
+    }
+    stop_watching = threading.Event()
+    watcher = threading.Thread(target=watch_for_cancel, args=(job_id, should_cancel, stop_watching))
+    watcher.daemon = True
+    watcher.start()
+
+    print(f"👷 Processing job {job_id} ({job['original_filename']})")
+    try:
+        web.process_job_background(job_id, job['input_path'], job['output_path'],
+                                   job['options'], job['original_filename'])
+    finally:
+        stop_watching.set()
+        web.active_jobs.pop(job_id, None)
+        web.redis_client.delete(f"job:{job_id}:payload", f"job:{job_id}:cancel")
+
+
+def dequeue(poll_timeout):
+    """Move the next job, highest priority first, into this worker's processing list"""
+    for queue_key in web.JOB_QUEUE_KEYS:
+        job_id = web.redis_client.lmove(queue_key, processing_key(), 'LEFT', 'RIGHT')
+        if job_id:
+            return job_id
+    # BLMOVE waits on a single list: block on the normal queue and look at the others again after the timeout
+    return web.redis_client.blmove('jobs:queue:normal', processing_key(), poll_timeout, 'LEFT', 'RIGHT')
+
+
+def work(stop_event=None, max_jobs=None, poll_timeout=1):
+    """Pull jobs from the Redis queues until stop_event is set or max_jobs have run"""
+    processed = 0
+    while not (stop_event and stop_event.is_set()):
+        heartbeat()
+        job_id = dequeue(poll_timeout)
+        if not job_id:
+            continue
+        try:
+            run_job(job_id)
+        except Exception as e:
+            print(f"❌ Worker error on job {job_id}: {e}")
+        finally:
+            web.redis_client.lrem(processing_key(), 1, job_id)
+        processed += 1
+        if max_jobs and processed >= max_jobs:
+            break
+    return processed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Video processing worker")
+    parser.add_argument('--concurrency', type=int, default=int(os.environ.get('WORKER_CONCURRENCY', 1)),
+                        help="jobs processed at the same time by this worker")
+    args = parser.parse_args()
+
+    if not web.REDIS_AVAILABLE:
+        print("❌ Redis is required to run a worker")
+        raise SystemExit(1)
+
+    heartbeat()
+    requeue_orphaned_jobs()
+    keeper = threading.Thread(target=keep_alive, name='worker-heartbeat')
+    keeper.daemon = True
+    keeper.start()
+
+    print(f"👷 Worker started with {args.concurrency} slot(s), waiting for jobs...")
+    threads = []
+    for index in range(args.concurrency):
+        thread = threading.Thread(target=work, name=f'worker-slot-{index}')
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        print("👋 Worker stopped")
+
+
+if __name__ == '__main__':
+    main()